@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+
+"""Device() startup time over the SVD files in github_dl/registry.txt.
+
+ python3 -m svd_gdb.bench MIRROR_DIR [SUBSTRING ...]
+ python3 -m svd_gdb.bench --report OUT.json MIRROR_DIR [SUBSTRING ...]
+ python3 -m svd_gdb.bench --compare OLD.json NEW.json
+
+MIRROR_DIR is a checkout of cmsis-svd-data, or pooch's cache of it;
+files from the registry that are not there are skipped.  Only files
+whose path contains one of the SUBSTRINGs are run, if any are given.
+
+For each file the first form prints the time to construct a Device
+parsing the XML, and constructing it again from the model cache (a
+fresh, empty one in a temporary directory).
+
+--report runs each file in its own process from a pool, one per
+core, and writes OUT.json: per file, the time to parse it without the
+model cache, the time to then make every peripheral, register and
+field object, how many there are, and the process's peak RSS, or the
+error if the Device could not be made.  Keep the report of one commit
+and --compare it with the next to see what a parser change did on
+every vendor's files.  Files run side by side, so times are a little
+noisier than with the first form.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+from . import svd_gdb, cache
+from .github_dl import cached
+
+def registry_svds(mirror, patterns=()):
+    "Paths of the registry's .svd files present under mirror"
+    ret = []
+    with open(os.path.join(cached.install_dir, 'registry.txt')) as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            name = line.split()[0]
+            if not name.endswith('.svd'):
+                continue
+            if patterns and not any(p in name for p in patterns):
+                continue
+            filename = os.path.join(mirror, name)
+            if os.path.exists(filename):
+                ret.append(filename)
+    return ret
+
+def time_device(filename, model_cache):
+    class Device(svd_gdb.Device):
+        _model_cache = model_cache
+
+    t0 = time.perf_counter()
+    Device(filename)
+    return time.perf_counter() - t0
+
+def main(mirror, patterns=()):
+    filenames = registry_svds(mirror, patterns)
+    if not filenames:
+        sys.exit('No registry SVD files found under %s'%mirror)
+
+    total_cold = total_cached = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        model_cache = cache.ModelCache(tmpdir)
+        model_cache.max_size = 1 << 40 # keep everything for the run
+
+        print('%8s %8s %6s  %s'%('cold', 'cached', 'ratio', 'file'))
+        for filename in filenames:
+            cold = time_device(filename, False)
+            time_device(filename, model_cache) # fills the cache
+            warm = time_device(filename, model_cache)
+            total_cold += cold
+            total_cached += warm
+            print('%8.3f %8.3f %6.1f  %s'%(cold, warm, cold / warm,
+                                          os.path.relpath(filename, mirror)))
+
+    print('%8.3f %8.3f %6.1f  total (%d files)'%(
+        total_cold, total_cached, total_cold / total_cached, len(filenames)))
+
+def measure(filename):
+    """Parse time, object count, time to make the objects and peak RSS
+    for one file, in a process of its own"""
+    import resource
+    import traceback
+    from . import index
+
+    class Device(svd_gdb.Device):
+        _model_cache = False
+
+    ret = {}
+    try:
+        t0 = time.perf_counter()
+        d = Device(filename) # with the dummy DebugInterface
+        ret['parse'] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        peripherals = d._peripherals
+        registers = index.all_registers(d)
+        fields = 0
+        for r in registers:
+            for f in r._fields:
+                fields += len(f) if isinstance(f, tuple) else 1
+        ret['build'] = time.perf_counter() - t0
+        ret['objects'] = len(peripherals) + len(registers) + fields
+    except Exception:
+        ret['error'] = traceback.format_exc().strip().splitlines()[-1]
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024 # bytes there, KiB on Linux
+    ret['peak_rss_kib'] = rss
+    return ret
+
+def git_commit():
+    "Commit of this checkout, for the report, or None"
+    import subprocess
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(out_filename, mirror, patterns=()):
+    import platform
+    import multiprocessing
+
+    filenames = registry_svds(mirror, patterns)
+    if not filenames:
+        sys.exit('No registry SVD files found under %s'%mirror)
+
+    files = {}
+    print('%8s %8s %8s %9s  %s'%('parse', 'build', 'objects', 'rss KiB', 'file'))
+    # A fresh process per file, so peak RSS is that file's
+    with multiprocessing.Pool(maxtasksperchild=1) as pool:
+        for filename, r in zip(filenames, pool.imap(measure, filenames)):
+            name = os.path.relpath(filename, mirror)
+            files[name] = r
+            if 'error' in r:
+                print('%8s %8s %8s %9s  %s: %s'%('', '', '', '', name, r['error']))
+            else:
+                print('%8.3f %8.3f %8d %9d  %s'%(r['parse'], r['build'],
+                                               r['objects'], r['peak_rss_kib'],
+                                               name))
+
+    with open(out_filename, 'w') as f:
+        json.dump({'commit': git_commit(),
+                   'python': platform.python_version(),
+                   'files': files}, f, indent=1, sort_keys=True)
+
+    ok = [r for r in files.values() if 'error' not in r]
+    print('%8.3f %8.3f %8d %9d  total (%d files, %d errors)'%(
+        sum(r['parse'] for r in ok), sum(r['build'] for r in ok),
+        sum(r['objects'] for r in ok),
+        max((r['peak_rss_kib'] for r in ok), default=0),
+        len(files), len(files) - len(ok)))
+
+def compare(old_filename, new_filename):
+    "Prints the change from one --report to another, file by file"
+    with open(old_filename) as f:
+        old = json.load(f)
+    with open(new_filename) as f:
+        new = json.load(f)
+
+    print('%s -> %s'%(old['commit'], new['commit']))
+    print('%7s %7s %9s %8s  %s'%('parse', 'build', 'rss KiB', 'objects', 'file'))
+    totals = {'parse': [0, 0], 'build': [0, 0]}
+    for name in sorted(set(old['files']) | set(new['files'])):
+        a = old['files'].get(name)
+        b = new['files'].get(name)
+        if a is None or b is None:
+            print('%35s  %s'%('only in ' + (old_filename if b is None
+                                            else new_filename), name))
+            continue
+        if 'error' in a or 'error' in b:
+            if a.get('error') != b.get('error'):
+                print('%35s  %s: %s'%('error', name, b.get('error', 'fixed')))
+            continue
+        for k in totals:
+            totals[k][0] += a[k]
+            totals[k][1] += b[k]
+        print('%6.2fx %6.2fx %+9d %+8d  %s'%(
+            b['parse'] / a['parse'], b['build'] / max(a['build'], 1e-9),
+            b['peak_rss_kib'] - a['peak_rss_kib'],
+            b['objects'] - a['objects'], name))
+    print('%6.2fx %6.2fx %9s %8s  total'%(
+        totals['parse'][1] / max(totals['parse'][0], 1e-9),
+        totals['build'][1] / max(totals['build'][0], 1e-9), '', ''))
+
+if __name__=="__main__":
+    args = sys.argv[1:]
+    if len(args) == 3 and args[0] == '--compare':
+        compare(args[1], args[2])
+    elif len(args) >= 3 and args[0] == '--report':
+        report(args[1], args[2], args[3:])
+    elif args and not args[0].startswith('--'):
+        main(args[0], args[1:])
+    else:
+        sys.exit(__doc__)
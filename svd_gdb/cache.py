@@ -0,0 +1,129 @@
+#!/usr/bin/python3
+
+"""On-disk caches, safe to share between processes.
+
+Entries are files named by a content hash, so concurrent processes
+computing the same entry write the same bytes.  Files are written to
+a temporary name and renamed into place, so a reader never sees a
+partial entry.  An entry's mtime is bumped on every hit and is used
+for least-recently-used eviction.
+
+The cache lives in $SVD_GDB_CACHE, or svd_gdb/ under $XDG_CACHE_HOME
+(default ~/.cache).
+"""
+
+import os
+import time
+import hashlib
+import tempfile
+
+def cache_dir(*subdirs):
+    base = os.environ.get('SVD_GDB_CACHE')
+    if not base:
+        base = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                            os.path.expanduser('~/.cache'),
+                            'svd_gdb')
+    path = os.path.join(base, *subdirs)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def atomic_write(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+def hash_key(*parts):
+    "Key from a sequence of str, bytes or nested lists/tuples of them"
+    h = hashlib.sha256()
+    def add(p):
+        if isinstance(p, (list, tuple)):
+            h.update(b'[%d' % len(p))
+            for x in p:
+                add(x)
+            h.update(b']')
+        else:
+            if isinstance(p, str):
+                p = p.encode()
+            elif not isinstance(p, bytes):
+                p = repr(p).encode()
+            h.update(b'%d:' % len(p))
+            h.update(p)
+    add(parts)
+    return h.hexdigest()
+
+class FileCache():
+    """Directory of files keyed by hash, evicted by age and total size"""
+    max_size = 64 << 20 # bytes
+    max_age = 30 * 24 * 3600 # seconds since last use
+    suffix = ''
+
+    def __init__(self, path):
+        self.path = path
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + self.suffix)
+
+    def get(self, key):
+        "Returns cached bytes, or None"
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(filename)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        atomic_write(self._filename(key), data)
+        self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(self.suffix) or name.startswith('.tmp_'):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                st = os.stat(filename)
+            except FileNotFoundError:
+                continue # another process evicted it
+            entries.append((st.st_mtime, st.st_size, filename))
+
+        entries.sort()
+        total = sum(size for mtime, size, filename in entries)
+        for mtime, size, filename in entries:
+            if total <= self.max_size and now - mtime <= self.max_age:
+                break
+            try:
+                os.unlink(filename)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+class StubCache(FileCache):
+    "Compiled stub binaries, see make_stub.MakeStub"
+    suffix = '.bin'
+
+    def __init__(self, path=None):
+        super().__init__(path or cache_dir('stubs'))
+
+class ModelCache(FileCache):
+    "Parsed SVD device models, see model.load()"
+    suffix = '.model'
+    max_size = 256 << 20
+
+    def __init__(self, path=None):
+        super().__init__(path or cache_dir('models'))
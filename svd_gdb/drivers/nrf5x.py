@@ -361,16 +361,12 @@ class NRF54(NRF5x):
         s_re = re.compile('GLOBAL_(.*)_S')
 
         # First collect all insecure peripherals
-        for att in dir(self):
-            m = ns_re.match(att)
-            if m:
-                setattr(self, m.group(1), getattr(self, att))
+        for att in self._find(ns_re, 'peripherals', 'regex'):
+            setattr(self, ns_re.match(att).group(1), getattr(self, att))
 
         # Override the insecure with secure addresses
-        for att in dir(self):
-            m = s_re.match(att)
-            if m:
-                setattr(self, m.group(1), getattr(self, att))
+        for att in self._find(s_re, 'peripherals', 'regex'):
+            setattr(self, s_re.match(att).group(1), getattr(self, att))
 
         self._gdb.make_stub.include_path = [
             self.sdk+'/modules/nrfx/templates/nrf54/'
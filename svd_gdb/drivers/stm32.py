@@ -241,12 +241,10 @@ class STM32F(svd_gdb.Device):
 
     def _ports_on(self, reg):
         # power up all the GPIOs by building a mask for RCC
-        enbits = [b
-                  for b in dir(reg)
-                  if b.startswith('IOP') and b.endswith('EN')]
+        enbits = self._find('IOP*EN', 'fields', within=reg)
         mask = 0
         for bit in enbits:
-            field = getattr(reg, bit)
+            field = self._lookup(bit)
             mask |= 1<<field._bit_offset
 
         reg |= mask
@@ -256,7 +254,7 @@ class STM32F1(STM32F):
         super().__init__(*args, **kwargs)
         assert 'STM32F1' in self._gdb.target_name
 
-        for gpio in (x for x in dir(self) if x.startswith('GPIO')):
+        for gpio in self._find('GPIO', 'peripherals', 'prefix'):
             port = getattr(self, gpio)
             self._add_pins(port, 16)
 
@@ -277,7 +275,7 @@ class STM32F3(STM32F):
         super().__init__(*args, **kwargs)
         assert 'STM32F3' in self._gdb.target_name
 
-        for gpio in (x for x in dir(self) if x.startswith('GPIO')):
+        for gpio in self._find('GPIO', 'peripherals', 'prefix'):
             port = getattr(self, gpio)
             self._add_pins(port, 16)
 
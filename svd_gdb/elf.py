@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+"""Minimal reader for 32-bit little-endian ELF files.
+
+Just enough to pull sections, symbols and loadable segments out of
+flash algorithms and firmware images, without a dependency on a full
+ELF library.
+"""
+
+import struct
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHF_ALLOC = 2
+PT_LOAD = 1
+
+class Section():
+    def __init__(self, elf, name, sh_type, flags, addr, offset, size, link):
+        self.elf = elf
+        self.name = name
+        self.type = sh_type
+        self.flags = flags
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+
+    @property
+    def data(self):
+        if self.type == SHT_NOBITS:
+            return bytes(self.size)
+        return self.elf.raw[self.offset:self.offset+self.size]
+
+    def __repr__(self):
+        return '<Section %s at 0x%08x, %d bytes>'%(self.name, self.addr, self.size)
+
+class Segment():
+    def __init__(self, elf, p_type, offset, vaddr, paddr, filesz, memsz):
+        self.elf = elf
+        self.type = p_type
+        self.offset = offset
+        self.vaddr = vaddr
+        self.paddr = paddr
+        self.filesz = filesz
+        self.memsz = memsz
+
+    @property
+    def data(self):
+        return self.elf.raw[self.offset:self.offset+self.filesz]
+
+class Elf():
+    def __init__(self, data):
+        self.raw = data = bytes(data)
+
+        if data[:4] != b'\x7fELF':
+            raise ValueError('Not an ELF file')
+        if data[4] != 1 or data[5] != 1:
+            raise ValueError('Only 32-bit little-endian ELF is supported')
+
+        (e_type, e_machine, e_version, self.entry, e_phoff, e_shoff,
+         e_flags, e_ehsize, e_phentsize, e_phnum, e_shentsize, e_shnum,
+         e_shstrndx) = struct.unpack_from('<HHIIIIIHHHHHH', data, 16)
+
+        headers = [struct.unpack_from('<IIIIIIIIII', data, e_shoff + i*e_shentsize)
+                   for i in range(e_shnum)]
+        if headers:
+            strtab = headers[e_shstrndx]
+            names = data[strtab[4]:strtab[4]+strtab[5]]
+        self.sections = []
+        for (name, sh_type, flags, addr, offset, size,
+             link, info, align, entsize) in headers:
+            name = names[name:names.index(b'\0', name)].decode()
+            self.sections.append(Section(self, name, sh_type, flags,
+                                         addr, offset, size, link))
+
+        self.segments = []
+        for i in range(e_phnum):
+            (p_type, offset, vaddr, paddr, filesz, memsz,
+             flags, align) = struct.unpack_from('<IIIIIIII', data,
+                                                e_phoff + i*e_phentsize)
+            self.segments.append(Segment(self, p_type, offset, vaddr,
+                                         paddr, filesz, memsz))
+
+        self._symbols = None
+
+    def section(self, name):
+        for s in self.sections:
+            if s.name == name:
+                return s
+        raise KeyError(name)
+
+    @property
+    def symbols(self):
+        "dict of symbol name to value"
+        if self._symbols is None:
+            self._symbols = {}
+            for s in self.sections:
+                if s.type != SHT_SYMTAB:
+                    continue
+                strtab = self.sections[s.link].data
+                data = s.data
+                for off in range(0, len(data), 16):
+                    name, value, size, info, other, shndx = struct.unpack_from(
+                        '<IIIBBH', data, off)
+                    if name:
+                        name = strtab[name:strtab.index(b'\0', name)].decode()
+                        self._symbols[name] = value
+        return self._symbols
+
+    def load_segments(self):
+        """Returns list of (physical address, data) for PT_LOAD segments
+        with file contents, which is what ends up in flash."""
+        return [(s.paddr, s.data)
+                for s in self.segments
+                if s.type == PT_LOAD and s.filesz]
+
+def write_image(intervals, machine=40):
+    """Returns an ELF executable with one PT_LOAD segment for each
+    (address, data) in intervals.  No sections; enough for
+    programming tools and for Elf.load_segments()."""
+    phoff = 52
+    offset = phoff + 32 * len(intervals)
+    headers = b''
+    body = b''
+    for address, data in intervals:
+        headers += struct.pack('<IIIIIIII', PT_LOAD, offset + len(body),
+                               address, address, len(data), len(data),
+                               5, 1)
+        body += data
+
+    ident = b'\x7fELF\x01\x01\x01' + bytes(9)
+    header = ident + struct.pack('<HHIIIIIHHHHHH',
+                                 2, machine, 1, 0, phoff, 0, 0,
+                                 52, 32, len(intervals), 40, 0, 0)
+    return header + headers + body
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+
+"""RAM-resident flash loader using CMSIS-Pack flash algorithms.
+
+A .FLM file (found in the vendor's device family pack) is an ELF
+containing position-independent functions Init(), UnInit(),
+EraseSector(), ProgramPage() and so on, plus a FlashDevice
+description of the flash geometry.
+
+The algorithm is copied into target RAM before each Init(), behind a
+small trampoline, and the trampoline is what gets called through
+gdb.Target.run_stub_timeout().  Only the trampoline is passed as the
+stub, so the algorithm, with the globals Init() has set up, stays put
+until UnInit().  Page data goes into RAM with write_mem(), as many
+pages as fit, and the trampoline calls ProgramPage() for each of them
+before stopping, so the halt/resume cost is paid per batch instead of
+per page.
+
+Optionally the pages are LZ4-compressed on the host (see lz4.py) and
+a stub built with make_stub unpacks them in RAM before calling
+ProgramPage(), which helps with images that are mostly padding.
+
+Usage:
+
+ >>> loader = flm.FlmLoader(target, 'nRF52xxx.FLM')
+ >>> target.flash_write_hex('app.hex', erase=True, loader=loader)
+
+"""
+
+import struct
+import time
+
+from . import elf
+from . import lz4
+
+# Thumb code, loaded at the start of the RAM area.
+#
+# offset 0: call r4 once:             blx r4; bkpt
+# offset 4: program r8 pages of r6 bytes from buffer r7 to flash r5:
+#
+#   loop: mov r0, r5 ; mov r1, r6 ; mov r2, r7 ; blx r4
+#         cmp r0, #0 ; bne done
+#         adds r5, r5, r6 ; adds r7, r7, r6
+#         mov r1, r8 ; subs r1, #1 ; mov r8, r1 ; bne loop
+#   done: bkpt
+TRAMPOLINE = struct.pack('<16H',
+                         0x47a0, 0xbe00,
+                         0x4628, 0x4631, 0x463a, 0x47a0,
+                         0x2800, 0xd105,
+                         0x19ad, 0x19bf,
+                         0x4641, 0x3901, 0x4688, 0xd1f3,
+                         0xbe00, 0xbf00)
+CALL_OFFSET = 0
+LOOP_OFFSET = 4
+
+FUNCTIONS = ('Init', 'UnInit', 'EraseSector', 'EraseChip',
+             'ProgramPage', 'Verify', 'BlankCheck')
+
+class FlashAlgorithm():
+    """Contents of a .FLM file: code image, entry points and flash
+    geometry.  Offsets are relative to the start of the image."""
+
+    def __init__(self, filename):
+        e = elf.Elf(open(filename, 'rb').read())
+
+        sections = [s for s in e.sections
+                    if s.flags & elf.SHF_ALLOC and s.name != 'DevDscr']
+        end = max(s.addr + s.size for s in sections)
+        image = bytearray(end)
+        for s in sections:
+            image[s.addr:s.addr+s.size] = s.data
+        self.image = bytes(image)
+
+        self.static_base = e.section('PrgData').addr
+
+        symbols = e.symbols
+        self.functions = {name: symbols[name]
+                          for name in FUNCTIONS
+                          if name in symbols}
+
+        dev = e.section('DevDscr').data
+        (self.version, name, self.dev_type, self.address, self.size,
+         self.page_size, res, self.empty, self.program_timeout,
+         self.erase_timeout) = struct.unpack_from('<H128sHIIIIB3xII', dev)
+        self.name = name.split(b'\0', 1)[0].decode()
+
+        self.sectors = [] # (sector size, offset from self.address)
+        for off in range(160, len(dev), 8):
+            size, offset = struct.unpack_from('<II', dev, off)
+            if size == 0xffffffff:
+                break
+            self.sectors.append((size, offset))
+
+    def sector_starts(self, address, length):
+        "Yields the start address of each sector overlapping a range"
+        end = address + length
+        for i, (size, offset) in enumerate(self.sectors):
+            if i+1 < len(self.sectors):
+                next_offset = self.sectors[i+1][1]
+            else:
+                next_offset = self.size
+            a = self.address + offset
+            while a < self.address + next_offset:
+                if a + size > address and a < end:
+                    yield a
+                a += size
+
+    def __repr__(self):
+        return '<FlashAlgorithm %s at 0x%08x, %d bytes>'%(
+            self.name, self.address, self.size)
+
+class FlmLoader():
+    stack_size = 0x800
+
+    def __init__(self, target, filename, address=None, clock=0,
+                 make_stub=None):
+        """address is where the algorithm goes in target RAM, default
+        start of RAM.  Everything from there to the stack is used.
+
+        If make_stub (a make_stub.MakeStub) is given, page data is
+        LZ4-compressed on the host and unpacked on the target by a
+        stub built with it.  The algorithm then defaults to going
+        above the stub's code and data area."""
+
+        self.target = target
+        self.algo = FlashAlgorithm(filename)
+        self.clock = clock
+
+        if not hasattr(target, 'ram'):
+            target.flash_probe()
+        ram_start, ram_length = target.ram[0]
+
+        self.program_stub = None
+        if make_stub:
+            self.program_stub = make_stub(
+                lz4.PROGRAM_STUB, extra_cflags=lz4.PROGRAM_STUB_CFLAGS)
+            self.program_stub_address = make_stub.function_addr
+            if address is None:
+                address = make_stub.heap_addr
+
+        if address is None:
+            address = ram_start
+
+        self.address = address
+        self.image_address = address + len(TRAMPOLINE)
+        self.buffer = (self.image_address + len(self.algo.image) + 3) & ~3
+
+        free = ram_start + ram_length - self.stack_size - self.buffer
+        if self.program_stub:
+            # second half of the buffer holds the compressed data
+            free //= 2
+        self.pages_per_batch = free // self.algo.page_size
+        if self.pages_per_batch < 1:
+            raise Exception('Not enough RAM for flash algorithm')
+        self.staging = self.buffer + self.pages_per_batch * self.algo.page_size
+
+    def covers(self, mem):
+        return (mem.offset >= self.algo.address and
+                mem.offset + mem.length <= self.algo.address + self.algo.size)
+
+    def load(self):
+        "Copies the algorithm to RAM, as it is in the .FLM, for Init()"
+        image = self.algo.image
+        if not self.target.holds(self.image_address, image):
+            self.target.write_mem(self.image_address, image)
+
+    def call(self, function, *args, timeout=3):
+        "Calls one algorithm function, returns its result"
+        regs = list(args) + [0] * (4 - len(args))
+        regs += [self.image_address + self.algo.functions[function] | 1,
+                 0, 0, 0, 0,
+                 self.image_address + self.algo.static_base]
+        self.target.run_stub_timeout(timeout, TRAMPOLINE, self.address, *regs,
+                                     entry=self.address + CALL_OFFSET)
+        return self.target.read_reg(0)
+
+    def _check(self, function, result, address=None):
+        if result:
+            message = '%s failed (%d)'%(function, result)
+            if address is not None:
+                message += ' at 0x%08x'%address
+            raise Exception(message)
+
+    def program_pages(self, address, data, timeout=3):
+        """Programs whole pages from data, which is copied to RAM a
+        batch at a time."""
+        page = self.algo.page_size
+        batch = page * self.pages_per_batch
+        while data:
+            d = data[:batch]
+            data = data[len(d):]
+            d += bytes([self.algo.empty]) * (-len(d) % page)
+            pages = len(d) // page
+
+            if self.program_stub:
+                packed = lz4.compress(d)
+                if len(packed) + 28 <= len(d):
+                    job = struct.pack('<7I',
+                                      self.staging + 28, len(packed),
+                                      self.buffer, len(d),
+                                      address, page,
+                                      self.image_address +
+                                      self.algo.functions['ProgramPage'] | 1)
+                    self.target.write_mem(self.staging, job + packed)
+                    self.target.run_stub_timeout(
+                        timeout * pages, self.program_stub,
+                        self.program_stub_address,
+                        self.staging, 0, 0, 0, 0, 0, 0, 0, 0,
+                        self.image_address + self.algo.static_base)
+                    self._check('ProgramPage', self.target.read_reg(0),
+                                address)
+                    address += len(d)
+                    continue
+
+            self.target.write_mem(self.buffer, d)
+            self.target.run_stub_timeout(
+                timeout * pages, TRAMPOLINE, self.address,
+                0, 0, 0, 0,
+                self.image_address + self.algo.functions['ProgramPage'] | 1,
+                address, page, self.buffer, pages,
+                self.image_address + self.algo.static_base,
+                entry=self.address + LOOP_OFFSET)
+            self._check('ProgramPage', self.target.read_reg(0), address)
+            address += len(d)
+
+    def commit(self, mem, progress_cb=None, erase=True):
+        """Same as gdb.Target.commit(), but through the flash algorithm"""
+
+        ret = mem.crc32()
+
+        runs = mem.runs()
+        timing = self.target.flash_timing
+        erase_timeout = max(3, self.algo.erase_timeout / 1000 * 2)
+
+        t0 = time.time()
+        if erase and runs:
+            self.load()
+            self._check('Init', self.call('Init', self.algo.address, self.clock, 1))
+            for addr, data in runs:
+                for sector in self.algo.sector_starts(addr, len(data)):
+                    self._check('EraseSector',
+                                self.call('EraseSector', sector,
+                                          timeout=erase_timeout),
+                                sector)
+            self._check('UnInit', self.call('UnInit', 1))
+        t1 = time.time()
+        timing['erase'] += t1 - t0
+
+        total = sum(len(data) for addr, data in runs)
+        written = 0
+        if runs:
+            self.load()
+            self._check('Init', self.call('Init', self.algo.address, self.clock, 2))
+        for addr, data in runs:
+            step = self.algo.page_size * self.pages_per_batch
+            for off in range(0, len(data), step):
+                self.program_pages(addr + off, data[off:off+step])
+                written += len(data[off:off+step])
+                if callable(progress_cb):
+                    progress_cb(written*100//total)
+        t2 = time.time()
+        timing['write'] += t2 - t1
+        timing['bytes'] += total
+
+        if runs:
+            self._check('UnInit', self.call('UnInit', 2))
+        timing['done'] += time.time() - t2
+
+        mem.clear()
+        return ret
@@ -18,10 +18,34 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-# Used to parse XML memory map from target
-from xml.dom.minidom import parseString
 import struct,array
 import time
+import binascii
+import bisect
+import hashlib
+import collections
+
+def _crc_table():
+    ret = []
+    for i in range(256):
+        c = i << 24
+        for j in range(8):
+            c = ((c << 1) ^ 0x04c11db7) if c & 0x80000000 else (c << 1)
+        ret.append(c & 0xffffffff)
+    return ret
+
+CRC_TABLE = None
+
+def gdb_crc32(data, crc=0xffffffff):
+    """CRC as computed by the qCRC packet: CRC-32 polynomial, MSB
+    first, initial value 0xffffffff, no final inversion."""
+    global CRC_TABLE
+    if CRC_TABLE is None:
+        CRC_TABLE = _crc_table()
+    table = CRC_TABLE
+    for b in data:
+        crc = ((crc << 8) & 0xffffffff) ^ table[(crc >> 24) ^ b]
+    return crc
 
 def hexify(s):
     """Convert a bytes object into hex bytes representation"""
@@ -37,6 +61,10 @@ class GetPacketTimeoutException(Exception):
 class InvalidStubResponseException(Exception):
     pass
 
+class ErrorResponseException(Exception):
+    "The stub answered a packet with an error, or does not support it"
+    pass
+
 class FakeSocket():
     """Emulate socket functions send and recv on a file object"""
     def __init__(self, file):
@@ -65,11 +93,19 @@ class FlashMemory(object):
         self.flash_ranges = flash_ranges
 
     class Segment:
+        """Flash segment contents, stored sparsely as sorted,
+        non-touching intervals of programmed bytes.  Anything not
+        programmed reads as erased (0xff)."""
+
         def __init__(self, offset, length, blocksize):
             self.offset = offset
             self.length = length
             self.blocksize = blocksize
-            self.blocks = list(None for i in range(length // blocksize))
+            self.clear()
+
+        def clear(self):
+            self.starts = [] # interval start addresses, sorted
+            self.chunks = [] # bytearray of data for each interval
 
         def prog(self, offset, data):
             assert type(data)==bytes
@@ -77,15 +113,84 @@ class FlashMemory(object):
             assert ((offset >= self.offset) and
                 (offset + len(data) <= self.offset + self.length))
 
-            while data:
-                index = (offset - self.offset) // self.blocksize
-                bloffset = (offset - self.offset) % self.blocksize
-                bldata = data[:self.blocksize-bloffset]
-                data = data[len(bldata):]; offset += len(bldata)
-                if self.blocks[index] is None: # Initialize a clear block
-                    self.blocks[index] = bytes(0xff for i in range(self.blocksize))
-                self.blocks[index] = (self.blocks[index][:bloffset] + bldata +
-                        self.blocks[index][bloffset+len(bldata):])
+            end = offset + len(data)
+
+            # Merge with every interval that overlaps or touches
+            i = bisect.bisect_right(self.starts, offset)
+            if i and self.starts[i-1] + len(self.chunks[i-1]) >= offset:
+                i -= 1
+            j = bisect.bisect_right(self.starts, end, i)
+
+            if i == j:
+                self.starts.insert(i, offset)
+                self.chunks.insert(i, bytearray(data))
+                return
+
+            start = min(self.starts[i], offset)
+            chunk = self.chunks[i]
+            if start < self.starts[i]:
+                chunk[0:0] = b'\xff' * (self.starts[i] - start)
+            for k in range(i+1, j):
+                pos = self.starts[k] - start
+                chunk[len(chunk):] = b'\xff' * (pos - len(chunk))
+                chunk[pos:pos+len(self.chunks[k])] = self.chunks[k]
+            pos = offset - start
+            chunk[pos:pos+len(data)] = data
+
+            self.starts[i:j] = [start]
+            self.chunks[i:j] = [chunk]
+
+        def intervals(self):
+            "Returns list of (address, data) of programmed bytes"
+            return [(start, bytes(chunk))
+                    for start, chunk in zip(self.starts, self.chunks)]
+
+        def runs(self):
+            """Coalesces programmed data into whole blocks.
+
+            Returns a list of (address, data), one entry per run of
+            adjacent blocks, so that each run can be erased as a
+            single range and written as a single stream."""
+            bs = self.blocksize
+            ret = []
+            for start, chunk in zip(self.starts, self.chunks):
+                bstart = start - (start - self.offset) % bs
+                if ret and bstart < ret[-1][0] + len(ret[-1][1]) + bs:
+                    addr, data = ret[-1]
+                    data += b'\xff' * (start - addr - len(data))
+                    data += chunk
+                else:
+                    data = bytearray(b'\xff' * (start - bstart))
+                    data += chunk
+                    ret.append((bstart, data))
+            return [(addr, bytes(data + b'\xff' * (-len(data) % bs)))
+                    for addr, data in ret]
+
+        def populated(self):
+            "Returns count of populated blocks"
+            return sum(len(data) for addr, data in self.runs()) // self.blocksize
+
+        @property
+        def blocks(self):
+            "List with the data of each block, or None if not populated"
+            ret = [None] * (self.length // self.blocksize)
+            for addr, data in self.runs():
+                index = (addr - self.offset) // self.blocksize
+                for i in range(0, len(data), self.blocksize):
+                    ret[index + i//self.blocksize] = data[i:i+self.blocksize]
+            return ret
+
+        def crc32(self):
+            """Returns (address, length, crc32) of the whole segment,
+            unprogrammed bytes counted as 0xff."""
+            crc = 0
+            addr = self.offset
+            for start, chunk in zip(self.starts, self.chunks):
+                crc = binascii.crc32(b'\xff' * (start - addr), crc)
+                crc = binascii.crc32(chunk, crc)
+                addr = start + len(chunk)
+            crc = binascii.crc32(b'\xff' * (self.offset + self.length - addr), crc)
+            return (self.offset, self.length, crc)
 
     def flash_probe(self):
         self.mem = []
@@ -134,33 +239,225 @@ class FlashMemory(object):
         return lowest_addr, highest_addr
 
     def flash_write_prepare(self, address, data):
+        """Stores data for programming.  Data outside the flash
+        segments is dropped."""
         for m in self.mem:
-            if (address >= m.offset) and (address + len(data) <= m.offset + m.length):
-                 m.prog(address, data)
+            start = max(address, m.offset)
+            end = min(address + len(data), m.offset + m.length)
+            if start < end:
+                m.prog(start, bytes(data[start-address:end-address]))
+
+    def flash_prepare_ihex(self, ih):
+        "Like flash_prepare_hex(), but from an intelhex.IntelHex object"
+        for start, end in ih.segments():
+            self.flash_write_prepare(start, ih.tobinstr(start, end-1))
+
+    def flash_prepare_bin(self, binfile, address):
+        self.flash_write_prepare(address, open(binfile, 'rb').read())
+
+    def flash_prepare_elf(self, elffile):
+        "Loads the PT_LOAD segments of an ELF, at their physical addresses"
+        from . import elf
+        for address, data in elf.Elf(open(elffile, 'rb').read()).load_segments():
+            self.flash_write_prepare(address, data)
+
+    def flash_intervals(self):
+        "Returns list of (address, data) of everything prepared"
+        ret = []
+        for segment in self.mem:
+            ret.extend(segment.intervals())
+        return ret
 
     @property
     def ihex(self):
         """Returns the same data in a intelhex-derived object.
 
         Documentation at http://pythonhosted.org/IntelHex/
-
-        It would be nice to unify the code, but until then this
-        function provides some glue."""
+        """
 
         import intelhex
         ret = intelhex.IntelHex()
 
-        for segment in self.mem:
-            data = []
-            for num,block in enumerate(segment.blocks):
-                if block:
-                    for i,c in enumerate(block):
-                        address = (segment.offset +
-                                   num * segment.blocksize +
-                                   i)
-                        ret[address] = c
+        for address, data in self.flash_intervals():
+            ret.puts(address, data)
+        return ret
+
+    def flash_export_bin(self, start=None, end=None):
+        """Returns prepared data from start to end as a flat image,
+        0xff where nothing is prepared.  Defaults to the span of the
+        prepared data."""
+        intervals = self.flash_intervals()
+        if start is None:
+            start = min((a for a, d in intervals), default=0)
+        if end is None:
+            end = max((a + len(d) for a, d in intervals), default=start)
+        ret = bytearray(b'\xff' * (end - start))
+        for address, data in intervals:
+            lo = max(address, start)
+            hi = min(address + len(data), end)
+            if lo < hi:
+                ret[lo-start:hi-start] = data[lo-address:hi-address]
+        return bytes(ret)
+
+    def flash_export_elf(self):
+        "Returns the prepared data as an ELF file image"
+        from . import elf
+        return elf.write_image(self.flash_intervals())
+
+class RamAllocator():
+    """Hands out target RAM to resident stubs.
+
+    Keeps a table of which stub is loaded where.  When a new stub
+    does not fit, the least recently used stubs are evicted until it
+    does."""
+
+    align = 8
+
+    def __init__(self, ram, stack_size=0):
+        self.free = [] # sorted (start, end)
+        for i, (start, length) in enumerate(ram):
+            end = start + length
+            if i == 0:
+                end -= stack_size
+            self.free.append((start, end))
+        self.free.sort()
+        self.reserved = set()
+        self.table = collections.OrderedDict() # key -> (address, size)
+
+    def _release(self, start, end):
+        self.free.append((start, end))
+        self.free.sort()
+        merged = []
+        for s, e in self.free:
+            if merged and merged[-1][1] >= s:
+                merged[-1] = (merged[-1][0], max(e, merged[-1][1]))
+            else:
+                merged.append((s, e))
+        self.free = merged
+
+    def reserve(self, address, length):
+        "Takes a range out of use, e.g. for fixed-address stubs"
+        if (address, length) in self.reserved:
+            return
+        self.reserved.add((address, length))
+        self.clobber(address, length)
+        self._take(address, address + length)
+
+    def clobber(self, address, length):
+        "Forgets stubs overwritten by other writes"
+        end = address + length
+        for key, (a, size) in list(self.table.items()):
+            if a < end and address < a + size:
+                self.evict(key)
+
+    def evict(self, key):
+        address, size = self.table.pop(key)
+        self._release(address, address + size)
+
+    def lookup(self, key):
+        "Returns address of a loaded stub, or None"
+        if key not in self.table:
+            return None
+        self.table.move_to_end(key)
+        return self.table[key][0]
+
+    def find(self, size):
+        "Returns address of a free range of size, evicting if needed"
+        size = -(-size // self.align) * self.align
+        while True:
+            for s, e in self.free:
+                start = -(-s // self.align) * self.align
+                if start + size <= e:
+                    return start
+            if not self.table:
+                raise Exception('Stub of %d bytes does not fit in RAM'%size)
+            self.evict(next(iter(self.table)))
+
+    def load(self, key, address, size):
+        "Records a stub as loaded at address"
+        size = -(-size // self.align) * self.align
+        self._take(address, address + size)
+        self.table[key] = (address, size)
+
+    def _take(self, start, end):
+        free = []
+        for s, e in self.free:
+            if s < start:
+                free.append((s, min(e, start)))
+            if e > end:
+                free.append((max(s, end), e))
+        self.free = free
+
+    def __repr__(self):
+        return '\n'.join('0x%08x %6d %s'%(a, size, key[:12])
+                         for key, (a, size) in self.table.items())
+
+class StubProfile():
+    """Cycle counts of stub calls, from the DWT cycle counter.
+
+    Set Target.stub_profile to one of these and every stub call is
+    timed on the target (CYCCNT, which stops while the core is
+    halted) and on the host.  With clock (core Hz) given, the report
+    splits the wall time into target time and host/probe overhead.
+
+     >>> t.stub_profile = gdb.StubProfile(clock=64e6)
+     >>> for i in range(100): d.read_comp()
+     >>> print(t.stub_profile.report())
+    """
+
+    def __init__(self, clock=None):
+        self.clock = clock
+        self.samples = collections.OrderedDict() # entry -> [(cycles, wall)]
+
+    def add(self, entry, cycles, wall):
+        self.samples.setdefault(entry, []).append((cycles, wall))
+
+    def clear(self):
+        self.samples.clear()
+
+    def stats(self, entry):
+        "dict of cycle and wall time statistics for calls to entry"
+        import statistics
+        cycles = [c for c, w in self.samples[entry]]
+        wall = [w for c, w in self.samples[entry]]
+        ret = {'calls': len(cycles),
+               'cycles_min': min(cycles),
+               'cycles_median': statistics.median(cycles),
+               'cycles_max': max(cycles),
+               'cycles_stdev': statistics.pstdev(cycles),
+               'wall_median': statistics.median(wall)}
+        if self.clock:
+            overhead = [w - c / self.clock for c, w in self.samples[entry]]
+            ret['overhead_median'] = statistics.median(overhead)
         return ret
 
+    def report(self):
+        lines = []
+        for entry in self.samples:
+            st = self.stats(entry)
+            line = ('0x%08x: %d calls, cycles min %d median %d max %d, '
+                    'wall %.2f ms'%(entry, st['calls'], st['cycles_min'],
+                                     st['cycles_median'], st['cycles_max'],
+                                     st['wall_median'] * 1000))
+            if self.clock:
+                line += ' (target %.3f ms, overhead %.2f ms)'%(
+                    st['cycles_median'] / self.clock * 1000,
+                    st['overhead_median'] * 1000)
+            lines.append(line)
+        return '\n'.join(lines)
+
+# Cycle counter registers (ARMv7-M / ARMv8-M, not on Cortex-M0)
+DEMCR = 0xE000EDFC
+DEMCR_TRCENA = 1 << 24
+DWT_CTRL = 0xE0001000
+DWT_CTRL_CYCCNTENA = 1 << 0
+DWT_CYCCNT = 0xE0001004
+
+# System Control Space: NVIC, SCB (AIRCR, ...) and the debug registers
+# (DHCSR, DCRSR, ...).  Writes there can reset or change the core.
+SCS_START = 0xE000E000
+SCS_END = 0xE000F000
+
 class Target(FlashMemory):
     def __init__(self, sock):
         if "send" in dir(sock):
@@ -175,6 +472,17 @@ class Target(FlashMemory):
             self.sock = FakeSocket(sock)
 
         self.PacketSize=0x100 # default
+        self.last_stub = None # (address, length, sha256) of the stub in RAM
+        self._irqs_disabled = False
+        self.resident_rpc = None # stub_rpc.StubRpc waiting at its BKPT
+        self.stub_profile = None # StubProfile to time stub calls
+        self._cyccnt_enabled = False
+        self._regs = {} # register number -> value, while halted
+        self._nregs = None # registers in a 'g' packet
+        self._p_packets = True # probe supports p/P
+        self._ram_allocator = None
+        self.flash_timing = dict.fromkeys(('erase', 'write', 'done'), 0.0)
+        self.flash_timing['bytes'] = 0
         self.sock.send(b'+')
         self.sock.flushInput()
         self.get_supported()
@@ -290,6 +598,11 @@ class Target(FlashMemory):
 
         ret = []
         self.putpacket(b"qRcmd," + hexify(cmd))
+        # "monitor reset halt" and friends change the core behind our back
+        self._regs = {}
+        self._irqs_disabled = False
+        self._cyccnt_enabled = False
+        self.resident_rpc = None
 
         while True:
             s = self.getpacket()
@@ -346,6 +659,10 @@ class Target(FlashMemory):
         if (reply == b'') or (reply[:1] == b'E' and len(reply) == 3):
             raise Exception('Failed to attach to remote pid %d' % pid)
         self.last_stub = None
+        self._irqs_disabled = False
+        self._cyccnt_enabled = False
+        self._regs = {}
+        self.resident_rpc = None
 
     def detach(self):
         """Detach from target process (gdb "detach" command)"""
@@ -356,6 +673,10 @@ class Target(FlashMemory):
     def reset(self):
         """Reset the target system"""
         self.putpacket(b"r")
+        self._irqs_disabled = False
+        self._cyccnt_enabled = False
+        self._regs = {}
+        self.resident_rpc = None
 
     def read_mem(self, addr, length):
         """Read length bytes from target at address addr"""
@@ -383,6 +704,17 @@ class Target(FlashMemory):
         """Write data to target at address addr"""
         data = bytes(data)
 
+        if self._ram_allocator:
+            self._ram_allocator.clobber(addr, len(data))
+        if self.last_stub:
+            a, n, h = self.last_stub
+            if a < addr + len(data) and addr < a + n:
+                self.last_stub = None
+        if addr < SCS_END and SCS_START < addr + len(data):
+            self._regs = {}
+            self._cyccnt_enabled = False
+            self.resident_rpc = None
+
         while data:
             d = data[:self.PacketSize-44]
             data = data[len(d):]
@@ -395,6 +727,76 @@ class Target(FlashMemory):
                 raise Exception('%s Error writing to memory at 0x%08X' % (response, addr))
             addr += len(d)
 
+    def crc32(self, addr, length):
+        "CRC of target memory computed by the target, see gdb_crc32()"
+        self.putpacket(b"qCRC:%X,%X" % (addr, length))
+        reply = self.getpacket()
+        if (reply == b'') or (reply[:1] == b'E' and len(reply) == 3):
+            raise ErrorResponseException('Error computing CRC at 0x%08X : "%s"' % (addr, reply))
+        if not reply.startswith(b'C'):
+            raise InvalidStubResponseException('Invalid response to qCRC packet: %r' % reply)
+        return int(reply[1:], 16)
+
+    def holds(self, addr, data):
+        "True if target memory at addr matches data, by CRC"
+        try:
+            return self.crc32(addr, len(data)) == gdb_crc32(data)
+        except ErrorResponseException:
+            return False # no qCRC support, or not readable
+
+    def diff(self, image, leaf_size=256):
+        """Compares target memory against image without reading it all.
+
+        image is a FlashMemory (whatever is prepared in it) or a
+        list of (address, data).  Ranges whose CRC disagrees are
+        split in half recursively; ranges down to leaf_size bytes
+        are read back and compared byte for byte.
+
+        Without qCRC support, everything is read back.
+
+        Returns a list of (start, end) address ranges which differ.
+        """
+        if isinstance(image, FlashMemory):
+            image = image.flash_intervals()
+
+        ret = []
+        no_crc = False
+        def compare(addr, data):
+            target = self.read_mem(addr, len(data))
+            start = None
+            for i, (a, b) in enumerate(zip(data + b'\0', target + b'\0')):
+                if a != b and start is None:
+                    start = i
+                elif a == b and start is not None:
+                    ret.append((addr + start, addr + i))
+                    start = None
+
+        def bisect_range(addr, data):
+            nonlocal no_crc
+            if len(data) <= leaf_size or no_crc:
+                return compare(addr, data)
+            try:
+                if self.crc32(addr, len(data)) == gdb_crc32(data):
+                    return
+            except ErrorResponseException:
+                no_crc = True
+                return compare(addr, data)
+            half = (len(data) // 2 + leaf_size - 1) // leaf_size * leaf_size
+            bisect_range(addr, data[:half])
+            bisect_range(addr + half, data[half:])
+
+        for addr, data in image:
+            bisect_range(addr, bytes(data))
+
+        # join ranges split at bisection boundaries
+        merged = []
+        for start, end in ret:
+            if merged and merged[-1][1] == start:
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
     def write32(self, address, value):
         """Convenience function.
         uint32_t little-endian values are everywhere.
@@ -411,6 +813,9 @@ class Target(FlashMemory):
 
     def read_regs(self):
         """Read target core registers"""
+        if self._nregs and len(self._regs) >= self._nregs:
+            return array.array('I', (self._regs[i] for i in range(self._nregs)))
+
         self.putpacket(b"g")
         reply = self.getpacket()
         if (reply == b'') or (reply[:1] == b'E' and len(reply) == 3):
@@ -420,6 +825,8 @@ class Target(FlashMemory):
         except Exception:
             raise Exception('Invalid response to register read packet: %r' % reply)
         ret = array.array('I',data)
+        self._nregs = len(ret)
+        self._regs = dict(enumerate(ret))
         return ret
 
     def write_regs(self, *regs):
@@ -427,7 +834,59 @@ class Target(FlashMemory):
         data = struct.pack("=%dL" % len(regs), *regs)
         self.putpacket(b"G" + hexify(data))
         if self.getpacket() != b'OK':
+            self._regs = {}
             raise Exception('Error writing to target core registers')
+        self._regs = dict(enumerate(regs))
+
+    def read_reg(self, n):
+        """Read one core register, from the cache if it is known since
+        the target stopped"""
+        if n in self._regs:
+            return self._regs[n]
+        if self._p_packets:
+            self.putpacket(b"p%x" % n)
+            reply = self.getpacket()
+            if reply == b'':
+                self._p_packets = False
+            elif reply[:1] == b'E' and len(reply) == 3:
+                raise Exception('Error reading register %d' % n)
+            else:
+                value, = struct.unpack('<I', unhexify(reply)[:4])
+                self._regs[n] = value
+                return value
+        return self.read_regs()[n]
+
+    def write_reg(self, n, value):
+        """Write one core register"""
+        if self._p_packets:
+            self.putpacket(b"P%x=" % n + hexify(struct.pack('<I', value)))
+            reply = self.getpacket()
+            if reply == b'OK':
+                self._regs[n] = value
+                return
+            if reply != b'':
+                raise Exception('Error writing register %d' % n)
+            self._p_packets = False
+        regs = list(self.read_regs())
+        regs[n] = value
+        self.write_regs(*regs)
+
+    # Up to this many changed registers are written with P packets,
+    # more with one G packet.
+    max_p_writes = 4
+
+    def set_regs(self, values):
+        """Write core registers from a dict of register number to
+        value.  Registers known to hold the value already are skipped."""
+        changed = {n: v for n, v in values.items() if self._regs.get(n) != v}
+        if self._p_packets and len(changed) <= self.max_p_writes:
+            for n, v in changed.items():
+                self.write_reg(n, v)
+        elif changed:
+            regs = list(self.read_regs())
+            for n, v in changed.items():
+                regs[n] = v
+            self.write_regs(*regs)
 
     def memmap_read(self):
         """Read the XML memory map from target"""
@@ -447,54 +906,158 @@ class Target(FlashMemory):
     def resume(self):
         """Resume target execution"""
         self.putpacket(b"c")
+        self._regs = {}
+        self._irqs_disabled = False # its code may enable them again
         #self.last_stub = None
 
     def interrupt(self):
         """Interrupt target execution"""
         self.sock.send(b"\x03")
+        self._regs = {}
         self.last_stub = None
+        self._irqs_disabled = False
+        self.resident_rpc = None
         self.await_stop_response('SIGINT')
 
-    def run_stub_timeout(self, timeout, stub, address, *args):
-        """Execute a binary stub at address, passing args in core registers."""
+    def run_stub_timeout(self, timeout, stub, address, *args, entry=None):
+        """Execute a binary stub at address, passing args in core registers.
+
+        Execution starts at address, or at entry if that is given."""
         #self.reset() # Ensure processor is in sane state
         #time.sleep(0.1)
 
+        self.resident_rpc = None
+
+        stub = bytes(stub)
+        h = hashlib.sha256(stub).digest()
+        if self.last_stub != (address, len(stub), h):
+            # Still there from an earlier session or before a halt?
+            if not self.holds(address, stub):
+                self.write_mem(address, stub)
+            self.last_stub = (address, len(stub), h)
+        self.disable_irqs()
+
+        if entry is None:
+            entry = address
+        self.call_timeout(timeout, entry, *args)
+
+    def disable_irqs(self):
+        """Disables and clears all NVIC interrupts, unless already done
+        since the target last ran its own code"""
+        if self._irqs_disabled:
+            return
+        # Only write ICER/ICPR if anything is enabled in ISER
+        if any(self.read_mem(0xE000E100, 4*8)):
+            self.write_mem(0xE000E180, b'\xff'*4*8)
+            self.write_mem(0xE000E280, b'\xff'*4*8)
+        self._irqs_disabled = True
+
+    def call_timeout(self, timeout, entry, *args):
+        """Execute code already in RAM at entry, passing args in core
+        registers, and wait for it to stop."""
+
         def pr():
             regnames = "r0 r1 r2 r3 r4 r5 r6 r7 r8 r9 r10 r11 r12 sp lr pc xpsr fpscr msp psp special".split()
             print('\n'.join("%s = 0x%x"%(a,b) for a,b in zip(regnames,self.read_regs())))
 
-        if not stub==self.last_stub:
-            self.write_mem(address, stub)
-            self.last_stub = stub
-
-            # disable interrupts by writing ICE:
-            self.write_mem(0xE000E180, b'\xff'*4*8)
-            self.write_mem(0xE000E280, b'\xff'*4*8)
-
+        if not hasattr(self, 'ram'):
+            self.flash_probe()
         stack_pointer = self.ram[0][0] + self.ram[0][1] # end of ram
 
-        regs = list(self.read_regs())
-        regs[:len(args)] = args
-        old_pc = regs[15]
-        regs[15] = address # pc
+        profile = self.stub_profile
+        if profile is not None:
+            t0 = time.time()
+            self.start_cycle_counter()
+
+        regs = dict(enumerate(args))
+        regs[15] = entry # pc
         regs[17] = stack_pointer # msp, sets sp
-        regs[18] = regs[17] # psp, just in case
-        self.write_regs(*regs)
-        regs = list(self.read_regs())
-        assert regs[15] == address
+        regs[18] = stack_pointer # psp, just in case
+        self.set_regs(regs)
+        del self._regs[15] # read back pc, to check the write
+        assert self.read_reg(15) == entry
+        irqs_disabled = self._irqs_disabled
         self.resume()
         self.await_stop_response('SIGTRAP', timeout=timeout)
+        self._irqs_disabled = irqs_disabled # only the stub ran
+
+        if profile is not None:
+            wall = time.time() - t0
+            profile.add(entry, self.read32(DWT_CYCCNT), wall)
+
+    def start_cycle_counter(self):
+        "Enables the DWT cycle counter if needed, and zeroes it"
+        if not self._cyccnt_enabled:
+            self.write32(DEMCR, self.read32(DEMCR) | DEMCR_TRCENA)
+            self.write32(DWT_CTRL, self.read32(DWT_CTRL) | DWT_CTRL_CYCCNTENA)
+            self._cyccnt_enabled = True
+        self.write32(DWT_CYCCNT, 0)
+
+    # RAM kept free at the top of RAM for the stub stack
+    stub_stack_size = 0x800
+
+    @property
+    def ram_allocator(self):
+        "RamAllocator for resident stubs, built from the memory map"
+        if self._ram_allocator is None:
+            if not hasattr(self, 'ram'):
+                self.flash_probe()
+            self._ram_allocator = RamAllocator(self.ram, self.stub_stack_size)
+        return self._ram_allocator
+
+    def run_resident(self, stub, *args, timeout=3):
+        """Execute a make_stub.ResidentStub.
+
+        Each resident stub is built for its own address in RAM and
+        stays there, so alternating between stubs does not upload
+        code again.  Least recently used stubs are evicted when RAM
+        runs out."""
+        self.resident_rpc = None
+
+        alloc = self.ram_allocator
+        # keep clear of the fixed-address stubs of run_stub_timeout()
+        ms = stub.make_stub
+        alloc.reserve(ms.function_addr, ms.heap_addr - ms.function_addr)
+
+        address = alloc.lookup(stub.key)
+        if address is None:
+            address = alloc.find(stub.size)
+            code = stub.build(address)
+            if len(code) > stub.size:
+                raise Exception('Stub grew when relocated')
+            self.write_mem(address, code)
+            alloc.load(stub.key, address, stub.size)
+        self.disable_irqs()
+
+        self.call_timeout(timeout, address, *args)
 
     def await_stop_response(self, await_signame, timeout=5):
         reply = None
         while not reply:
             reply = self.getpacket(timeout=timeout)
 
-        reply_signame = {b'T02':'SIGINT',
-                         b'T05':'SIGTRAP',
-                         b'T0B':'SIGSEGV',
-                         b'T1D':'SIGLOST'}.get(reply,repr(reply))
+        signal = None
+        if reply[:1] in (b'S', b'T'):
+            try:
+                signal = int(reply[1:3], 16)
+            except ValueError:
+                pass
+        if reply[:1] == b'T':
+            # expedited registers, n:value;
+            for item in reply[3:].split(b';'):
+                n, _, value = item.partition(b':')
+                try:
+                    n = int(n, 16)
+                    value = unhexify(value)
+                except ValueError:
+                    continue # thread:, swbreak: etc.
+                if len(value) == 4:
+                    self._regs[n], = struct.unpack('<I', value)
+
+        reply_signame = {0x02:'SIGINT',
+                         0x05:'SIGTRAP',
+                         0x0b:'SIGSEGV',
+                         0x1d:'SIGLOST'}.get(signal,repr(reply))
 
         if not reply_signame == await_signame:
             message = "Invalid stop response: %r" % reply
@@ -511,59 +1074,64 @@ class Target(FlashMemory):
         if self.getpacket() != b'OK':
             raise Exception("Failed to erase flash")
 
+    def flash_done(self):
+        self.putpacket(b"vFlashDone")
+        if self.getpacket() != b'OK':
+            raise Exception("Failed to commit")
+
     def commit(self, mem, progress_cb=None, erase=True):
         """Commits the blocks of memory to flash.
 
+        Contiguous blocks are coalesced, so each run is erased with
+        one vFlashErase, then all the data is streamed with
+        vFlashWrite and finished with a single vFlashDone.  Time spent
+        in each phase is accumulated in self.flash_timing.
+
         Returns a tuple of (address, length, crc32), which could be
         used for verification.
         """
 
-        totalblocks = 0
-        for b in mem.blocks:
-            if b is not None: totalblocks += 1
+        ret = mem.crc32()
 
-        combined = b''
-        for i in range(len(mem.blocks)):
-            data = mem.blocks[i]
-            if data is None:
-                data = b''
-            # pad
-            data += b'\xff' * (mem.blocksize - len(data))
-            combined += data
-
-        ret = (mem.offset, len(combined), binascii.crc32(combined))
-
-        block = 0
-        for i in range(len(mem.blocks)):
-            data = mem.blocks[i]
-            addr = mem.offset + mem.blocksize * i
-            if data is None: continue
-
-            block += 1
-            if isinstance(progress_cb, collections.Callable):
-                progress_cb(block*100//totalblocks)
-
-            # Erase the block
-            if erase:
-                self.flash_erase(mem.offset + mem.blocksize*i, mem.blocksize)
+        runs = mem.runs()
+        timing = self.flash_timing
 
+        t0 = time.time()
+        if erase:
+            for addr, data in runs:
+                self.flash_erase(addr, len(data))
+        t1 = time.time()
+        timing['erase'] += t1 - t0
+
+        total = sum(len(data) for addr, data in runs)
+        written = 0
+        for addr, data in runs:
             while data:
                 d = data[:self.PacketSize-44]
                 data = data[len(d):]
-                #print "Writing %d bytes at 0x%X" % (len(d), addr)
                 self.putpacket(b"vFlashWrite:%08X:%s" % (addr, d))
                 addr += len(d)
+                written += len(d)
                 if self.getpacket() != b'OK':
                     raise Exception("Failed to write flash")
 
-            self.putpacket(b"vFlashDone")
-            if self.getpacket() != b'OK':
-                raise Exception("Failed to commit")
+                if callable(progress_cb):
+                    progress_cb(written*100//total)
+        t2 = time.time()
+        timing['write'] += t2 - t1
+        timing['bytes'] += total
 
-        mem.blocks = list(None for i in range(mem.length // mem.blocksize))
+        if runs:
+            self.flash_done()
+        timing['done'] += time.time() - t2
+
+        mem.clear()
         return ret
 
     def flash_probe(self):
+        # Used to parse XML memory map from target
+        from xml.dom.minidom import parseString
+
         self.mem = []
         self.ram = []
         xmldom = parseString(self.memmap_read())
@@ -591,18 +1159,62 @@ class Target(FlashMemory):
 
         return self.mem
 
-    def flash_commit(self, progress_cb=None, erase=True):
+    # Use "monitor erase_mass" instead of per-range erases when at
+    # least this fraction of the flash blocks is being rewritten.
+    mass_erase_fraction = 0.5
+
+    def flash_mass_erase(self):
+        self.monitor('erase_mass')
+
+    def flash_commit(self, progress_cb=None, erase=True, mass_erase=False,
+                     loader=None):
+        """Commits all flash segments.
+
+        If mass_erase is set and most of the flash is being rewritten,
+        the whole device is erased in one command.  Blocks not being
+        written are lost in that case.
+
+        loader is an optional RAM-resident flash loader (see flm.py)
+        used instead of the probe's flash driver for the segments it
+        covers."""
+        self.flash_timing = dict.fromkeys(('erase', 'write', 'done'), 0.0)
+        self.flash_timing['bytes'] = 0
+
+        if erase and mass_erase:
+            populated = sum(m.populated() for m in self.mem)
+            total = sum(m.length // m.blocksize for m in self.mem)
+            if populated >= total * self.mass_erase_fraction:
+                t0 = time.time()
+                self.flash_mass_erase()
+                self.flash_timing['erase'] += time.time() - t0
+                erase = False
+
         ret = []
         for m in self.mem:
-            ret.append(self.commit(m, progress_cb, erase))
+            if loader and loader.covers(m):
+                ret.append(loader.commit(m, progress_cb, erase))
+            else:
+                ret.append(self.commit(m, progress_cb, erase))
             print()
         return ret
 
-    def flash_write_hex(self, hexfile, progress_cb=None, erase=False):
+    def flash_timing_report(self):
+        "One-line breakdown of the time spent in the last flash_commit()"
+        t = self.flash_timing
+        total = t['erase'] + t['write'] + t['done']
+        rate = t['bytes'] / total / 1024 if total else 0
+        return ('%d bytes in %.2f s (%.1f KiB/s): '
+                'erase %.2f s, write %.2f s, done %.2f s'%(
+                    t['bytes'], total, rate,
+                    t['erase'], t['write'], t['done']))
+
+    def flash_write_hex(self, hexfile, progress_cb=None, erase=False,
+                        mass_erase=False, loader=None):
         self.flash_probe()
-        self.flash_prepare_hex(self, hexfile)
+        self.flash_prepare_hex(hexfile)
         try:
-            self.flash_commit(progress_cb, erase)
+            self.flash_commit(progress_cb, erase, mass_erase, loader)
         except:
             print("Flash write failed! Is device protected?\n")
             raise
+        print(self.flash_timing_report())
@@ -1,7 +1,5 @@
 #!/usr/bin/env python
 
-import pooch
-
 import hashlib
 import os.path
 install_dir = os.path.dirname(__file__)
@@ -18,10 +16,6 @@ class GitBlobHash:
 
         return hashlib.sha1(b'blob %d\0'%len(obj)+obj).hexdigest()
 
-pooch.hashes.ALGORITHMS_AVAILABLE['git_sha'] = GitBlobHash
-
-import time
-
 class PoochWrap:
     def __init__(self,
                  github_user, github_project,
@@ -36,6 +30,11 @@ class PoochWrap:
     @property
     def pooch(self):
         if not self._pooch:
+            # pooch pulls in requests, which is slow to import, so
+            # wait until a file is actually fetched.
+            import pooch
+            pooch.hashes.ALGORITHMS_AVAILABLE['git_sha'] = GitBlobHash
+
             registry_file = open(self.registry_filename)
 
             # pooch.load_registry() uses shlex.split() and is *very*
@@ -0,0 +1,251 @@
+#!/usr/bin/python3
+
+"""Lookups over a whole Device, built once on first use.
+
+NameIndex finds objects by name, or by words of their descriptions:
+
+ >>> d._find('PSEL*', 'fields')
+ ['SPIM0.PSEL.MISO', ...]
+ >>> d._lookup('SPIM0.PSEL.MISO')
+
+AddressIndex maps addresses back to registers, for bus traces, fault
+addresses (BFAR/MMFAR) and read_mem() dumps:
+
+ >>> d._registers_at(0x40000400)
+ [nrf52.POWER.RESETREAS = 0x00000004]
+ >>> for reg, value in d._decode(0x40000400, d.read_mem(0x40000400, 64)):
+ ...     print(reg._repr_no_get(), value)
+"""
+
+import re
+import array
+import fnmatch
+from bisect import bisect_left
+
+from .svd_gdb import Device, SvdObj, Register, ElementGroup, Int32
+
+def all_registers(device):
+    """Every register of device, with each dim element, in the order
+    of _peripherals and of their _child_regs before sorting"""
+    ret = []
+    def add(obj):
+        for x in obj._registers + obj._clusters:
+            for y in (x if isinstance(x, tuple) else (x,)):
+                if isinstance(y, Register):
+                    ret.append(y)
+                else:
+                    add(y)
+    for p in device._peripherals:
+        add(p)
+    return ret
+
+class AddressIndex():
+    """Registers sorted by address, with the address and end of each
+    in arrays.  No register is longer than span bytes, so the ones
+    overlapping an address start less than span before it: one
+    bisect finds them, and registers that alias one another all do."""
+
+    def __init__(self, registers):
+        self.registers = sorted(registers, key=lambda r: r._addr)
+        self.starts = array.array('I', (r._addr for r in self.registers))
+        self.ends = array.array('I', (r._addr + max(r._size // 8, 1)
+                                      for r in self.registers))
+        self.span = max((e - s for s, e in zip(self.starts, self.ends)),
+                        default=1)
+
+    def find(self, start, end):
+        "Registers overlapping bytes start to end (exclusive), by address"
+        lo = bisect_left(self.starts, start - self.span + 1)
+        hi = bisect_left(self.starts, end, lo)
+        ends = self.ends
+        return [self.registers[j] for j in range(lo, hi) if ends[j] > start]
+
+    def decode(self, address, data, byteorder='little'):
+        """[(register, value)] for each register wholly inside data,
+        memory read from address, by address"""
+        ret = []
+        for r in self.find(address, address + len(data)):
+            offset = r._addr - address
+            n = max(r._size // 8, 1)
+            if offset >= 0 and offset + n <= len(data):
+                ret.append((r, Int32(int.from_bytes(data[offset:offset + n],
+                                                    byteorder))))
+        return ret
+
+def path_of(obj):
+    "Path of a peripheral, cluster, register or field, as for Device._lookup()"
+    name = obj._repr_no_get() if isinstance(obj, Register) else repr(obj)
+    return name.split('.', 1)[1]
+
+def literal_prefix(pattern, how):
+    "Text every name matching pattern starts with"
+    if how == 'prefix':
+        return pattern
+    if how == 'glob':
+        return re.split(r'[*?\[]', pattern)[0]
+    if '|' in pattern:
+        return ''
+    prefix = re.match(r'[A-Za-z0-9_ ]*', pattern).group()
+    if pattern[len(prefix):len(prefix)+1] in ('*', '?', '{'):
+        prefix = prefix[:-1] # the quantifier applies to the last char
+    return prefix
+
+class NameIndex():
+    """Names of the objects under root, a Device or one of its
+    peripherals, clusters or registers.  One table per kind:
+    'peripherals', 'registers', 'clusters', 'fields', 'enums' (the
+    names of enumerated values) and 'descriptions' (the words of
+    them, lower case).  A table is (names, paths), sorted by name, so
+    the names matching a prefix are one bisect away; globs and
+    regular expressions are narrowed to their literal prefix first.
+    Tables are made on first use."""
+
+    def __init__(self, root):
+        self.root = root
+        self.tables = {}
+        self.rows = {} # unsorted tables, from walk() and walk_fields()
+        self.objs = None # [(kind, path, object)] under root
+        self.fields_walked = False
+
+    def table(self, kind):
+        ret = self.tables.get(kind)
+        if ret is None:
+            if kind == 'peripherals':
+                rows = []
+                if isinstance(self.root, Device):
+                    rows = [(n, n) for n in self.root._peripheral_index()]
+            elif kind == 'descriptions':
+                rows = self.description_rows()
+            elif kind in ('registers', 'clusters'):
+                self.walk()
+                rows = self.rows.pop(kind)
+            elif kind in ('fields', 'enums'):
+                self.walk_fields()
+                rows = self.rows.pop(kind)
+            else:
+                raise ValueError('No %r names'%kind)
+            rows.sort(key=lambda r: r[0]) # ties stay in device order
+            ret = self.tables[kind] = ([r[0] for r in rows],
+                                       [r[1] for r in rows])
+        return ret
+
+    def walk(self):
+        """Rows of the registers and clusters tables, and objs for
+        everything down to registers"""
+        if self.objs is not None:
+            return
+        rows = self.rows
+        rows['registers'] = []
+        rows['clusters'] = []
+        objs = self.objs = []
+
+        def visit(kind, obj, path):
+            objs.append((kind, path, obj))
+            if kind == 'registers':
+                return
+            for kind, xs in (('registers', obj._registers),
+                             ('clusters', obj._clusters)):
+                for x in xs:
+                    rows[kind].append((x._name, path + '.' + x._name))
+                    for y in (x if type(x) is ElementGroup else (x,)):
+                        visit(kind, y, path + '.' + y._name)
+
+        root = self.root
+        if isinstance(root, Device):
+            for p in root._peripherals:
+                visit('peripherals', p, p._name)
+        elif isinstance(root, SvdObj):
+            visit(root._kind, root, path_of(root))
+        else:
+            visit('peripherals', root, path_of(root))
+
+    def walk_fields(self):
+        "Rows of the fields and enums tables, and objs for the fields"
+        self.walk()
+        if self.fields_walked:
+            return
+        self.fields_walked = True
+        rows = self.rows
+        rows['fields'] = []
+        rows['enums'] = []
+        fields = []
+        for kind, path, reg in self.objs:
+            if kind != 'registers':
+                continue
+            for x in reg._fields:
+                rows['fields'].append((x._name, path + '.' + x._name))
+                for y in (x if type(x) is ElementGroup else (x,)):
+                    fpath = path + '.' + y._name
+                    fields.append(('fields', fpath, y))
+                    rows['enums'] += [(name, fpath) for name in y._enum_names()]
+        self.objs += fields
+
+    def description_rows(self):
+        self.walk_fields()
+        texts = descriptions([obj for kind, path, obj in self.objs])
+        rows = []
+        for (kind, path, obj), text in zip(self.objs, texts):
+            for word in set(re.findall(r'\w+', (text or '').lower())):
+                rows.append((word, path))
+        return rows
+
+    def find(self, pattern, kind, how='glob'):
+        """Paths of the objects of kind whose name matches pattern, by
+        name.  how is 'glob', 'regex' (matched at the start, like
+        re.match()) or 'prefix'.  For 'enums' the path is the
+        field's, and for 'descriptions' pattern is one word, matched
+        regardless of case."""
+        names, paths = self.table(kind)
+
+        flags = 0
+        if how == 'regex' and not isinstance(pattern, str):
+            pattern = pattern.pattern # compiled
+        if kind == 'descriptions':
+            if how == 'regex':
+                flags = re.IGNORECASE
+            else:
+                pattern = pattern.lower()
+        prefix = literal_prefix(pattern, how)
+        if flags:
+            prefix = prefix.lower()
+
+        if how == 'glob':
+            match = re.compile(fnmatch.translate(pattern)).match
+        elif how == 'regex':
+            match = re.compile(pattern, flags).match
+        elif how == 'prefix':
+            match = None
+        else:
+            raise ValueError('how is glob, regex or prefix, not %r'%how)
+
+        lo = bisect_left(names, prefix)
+        hi = len(names)
+        if prefix:
+            hi = bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
+        ret = []
+        seen = set() # a path can have many matching description words
+        for j in range(lo, hi):
+            if match is None or match(names[j]):
+                if paths[j] not in seen:
+                    seen.add(paths[j])
+                    ret.append(paths[j])
+        return ret
+
+def descriptions(objs):
+    """_description of each of objs.  Those that are views on a model
+    have theirs read back from the SVD together, not one by one."""
+    ret = [None] * len(objs)
+    spans = {} # model -> [(position in objs, span)]
+    for j, obj in enumerate(objs):
+        m = getattr(obj, '_model', None)
+        kind = getattr(obj, '_kind', None)
+        if m is not None and kind is not None:
+            t = m.table(kind)
+            spans.setdefault(m, []).append((j, (t.desc_start[obj._i],
+                                                t.desc_end[obj._i])))
+        else:
+            ret[j] = getattr(obj, '_description', None)
+    for m, js in spans.items():
+        for (j, span), text in zip(js, m.descriptions([s for j, s in js])):
+            ret[j] = text
+    return ret
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+"""LZ4 block format, compressor on the host and decompressor on the
+target.
+
+Firmware images are mostly erased (0xff) padding and repetitive
+tables, which compress well, so fewer bytes have to cross the debug
+link.  The compressor is greedy with a single hash table, which is
+plenty for that kind of data and quick enough in pure Python.
+"""
+
+import struct
+
+MIN_MATCH = 4
+MAX_OFFSET = 0xffff
+
+def _length(out, n):
+    while n >= 255:
+        out.append(255)
+        n -= 255
+    out.append(n)
+
+def _sequence(out, literals, offset=0, matchlen=0):
+    ll = len(literals)
+    ml = matchlen - MIN_MATCH
+    out.append((min(ll, 15) << 4) | (min(ml, 15) if offset else 0))
+    if ll >= 15:
+        _length(out, ll - 15)
+    out += literals
+    if offset:
+        out += struct.pack('<H', offset)
+        if ml >= 15:
+            _length(out, ml - 15)
+
+def compress(data):
+    "Returns data compressed as one LZ4 block"
+    data = bytes(data)
+    n = len(data)
+    out = bytearray()
+    table = {}
+
+    # The format wants the last 5 bytes as literals, and no match
+    # starting in the last 12.
+    limit = n - 12
+    anchor = i = 0
+    while i < limit:
+        key = data[i:i+4]
+        candidate = table.get(key)
+        table[key] = i
+        if candidate is None or i - candidate > MAX_OFFSET:
+            i += 1
+            continue
+
+        maxlen = n - 5 - i
+        m = MIN_MATCH
+        step = 256
+        while step:
+            while (m + step <= maxlen and
+                   data[candidate+m:candidate+m+step] == data[i+m:i+m+step]):
+                m += step
+            step >>= 2
+
+        _sequence(out, data[anchor:i], i - candidate, m)
+        i += m
+        anchor = i
+
+    _sequence(out, data[anchor:])
+    return bytes(out)
+
+def decompress(data):
+    "Inverse of compress(), for checking"
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        token = data[i]; i += 1
+        ll = token >> 4
+        if ll == 15:
+            while True:
+                b = data[i]; i += 1
+                ll += b
+                if b != 255: break
+        out += data[i:i+ll]; i += ll
+        if i >= len(data):
+            break
+        offset, = struct.unpack_from('<H', data, i); i += 2
+        ml = token & 15
+        if ml == 15:
+            while True:
+                b = data[i]; i += 1
+                ml += b
+                if b != 255: break
+        for _ in range(ml + MIN_MATCH):
+            out.append(out[-offset])
+    return bytes(out)
+
+# Decompresses a block into RAM and hands it to a flash algorithm's
+# ProgramPage() a page at a time.  Built with -ffixed-r9 because the
+# flash algorithm expects its static base in r9.
+PROGRAM_STUB = """
+#include <stdint.h>
+
+typedef int (*program_page_t)(uint32_t adr, uint32_t sz, const uint8_t *buf);
+
+struct job {
+    const uint8_t *src;
+    uint32_t src_len;
+    uint8_t *dst;
+    uint32_t dst_len;
+    uint32_t flash_addr;
+    uint32_t page_size;
+    program_page_t program_page;
+};
+
+static uint32_t lz4_length(const uint8_t **src, uint32_t len) {
+    uint8_t b;
+    if (len == 15) {
+        do {
+            b = *(*src)++;
+            len += b;
+        } while (b == 255);
+    }
+    return len;
+}
+
+static uint32_t lz4_decompress(const uint8_t *src, uint32_t src_len, uint8_t *dst) {
+    const uint8_t *end = src + src_len;
+    uint8_t *d = dst;
+    const uint8_t *m;
+    uint32_t len;
+    uint8_t token;
+
+    while (src < end) {
+        token = *src++;
+        len = lz4_length(&src, token >> 4);
+        while (len--) *d++ = *src++;
+        if (src >= end) break;
+
+        m = d - (src[0] | (src[1] << 8));
+        src += 2;
+        len = lz4_length(&src, token & 15) + 4;
+        while (len--) *d++ = *m++;
+    }
+    return d - dst;
+}
+
+uint32_t function(struct job *j) {
+    uint32_t i;
+    int r;
+
+    if (lz4_decompress(j->src, j->src_len, j->dst) != j->dst_len)
+        return 0xffffffff;
+
+    for (i = 0; i < j->dst_len; i += j->page_size) {
+        r = j->program_page(j->flash_addr + i, j->page_size, j->dst + i);
+        if (r) return r;
+    }
+    return 0;
+}
+"""
+
+PROGRAM_STUB_CFLAGS = ['-ffixed-r9', '-fno-tree-loop-distribute-patterns']
+
+def throughput_comparison(target, hexfile, loader):
+    """Programs hexfile through plain vFlashWrite and then through
+    loader, returns the two timing reports."""
+    ret = []
+    for l in (None, loader):
+        target.flash_probe()
+        target.flash_prepare_hex(hexfile)
+        target.flash_commit(erase=True, loader=l)
+        ret.append(target.flash_timing_report())
+    return ret
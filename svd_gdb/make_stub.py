@@ -27,6 +27,12 @@ Writing functions:
    it is set up for the processor and ABI that Python was compiled
    for.
 
+Without a vendor SDK:
+
+ - Call use_svd_header() to build against a header generated from
+   the SVD.  Peripherals and registers have the same names as in
+   Python (GPIOC->CRH), and fields have _Pos and _Msk macros.
+
 nRF5x notes:
 
  - To be portable, do not explicitly include nrf5x.h or
@@ -36,13 +42,76 @@ nRF5x notes:
 
 import tempfile,shutil
 import subprocess
+import os
+import re
+import hashlib
+
+from . import cache
 
 CC = "arm-none-eabi-gcc"
 
-try:
-    subprocess.check_output([CC,"--version"])
-except subprocess.CalledProcessError:
-    raise Exception("The program '%s' is not installed." % CC)
+_toolchain_version = None
+
+def toolchain_version():
+    """Output of 'gcc --version', asked once per process.
+
+    Nothing runs the compiler until a stub is actually built, so
+    importing this module and constructing MakeStub stay cheap."""
+    global _toolchain_version
+    if _toolchain_version is None:
+        try:
+            _toolchain_version = subprocess.check_output([CC,"--version"])
+        except (OSError, subprocess.CalledProcessError):
+            raise Exception("The program '%s' is not installed." % CC)
+    return _toolchain_version
+
+CALL_S = """
+.global _start
+.extern function
+
+_start:
+    bl function
+    bkpt
+"""
+
+include_re = re.compile(r'^\s*#\s*include\s*([<"][^>"]+[>"])', re.M)
+
+def file_fingerprint(filename, data):
+    return (filename, hashlib.sha256(data).hexdigest())
+
+def resolve_includes(c_code, include_path):
+    """Finds the header files named in #include lines of c_code, and
+    in the headers they include, and so on.  Returns their
+    fingerprints, by contents, for the cache key.  Headers not found
+    on include_path (the compiler's own) are listed by name."""
+    ret = []
+    seen = set()
+
+    def walk(text, here):
+        for name in include_re.findall(text):
+            dirs = include_path
+            if name[0] == '"' and here:
+                dirs = [here] + include_path
+            name = name[1:-1]
+            for d in dirs:
+                filename = os.path.normpath(os.path.join(d, name))
+                if os.path.isfile(filename):
+                    break
+            else:
+                filename = None
+            if (filename or name) in seen:
+                continue
+            seen.add(filename or name)
+            if filename is None:
+                ret.append((name, None))
+                continue
+            with open(filename, 'rb') as f:
+                data = f.read()
+            ret.append(file_fingerprint(filename, data))
+            walk(data.decode('latin-1'), os.path.dirname(filename))
+
+    walk(c_code, None)
+    return ret
 
 class MakeStub():
     def __init__(self, device_svd,
@@ -90,21 +159,28 @@ class MakeStub():
                                 'CM4':'-mcpu=cortex-m4',
                                 'CM33':'-mcpu-cortex-m33'}[cpu._name])
 
+        self.device = device_svd
         self.function_addr = function_addr
         self.heap_addr = heap_addr
 
+        # Set to None to always compile
+        self.cache = cache.StubCache()
+
+        self._executor = None
+
     def __call__(self,
                  c_code,
                  extra_include_path=None,
                  extra_includes=None,
                  extra_defines=None,
                  extra_cflags=None,
-                 extra_sources=None):
+                 extra_sources=None,
+                 function_addr=None):
+        """Returns the stub binary.
 
-        if 1:
-            tmpdir = tempfile.mkdtemp(prefix='svd_gdb_')
-        else:
-            tmpdir = "/tmp/current"
+        With function_addr, the stub is linked to run from there
+        instead of self.function_addr, with its data and bss right
+        behind the code (and included in the binary)."""
 
         extra_include_path = extra_include_path or []
         extra_includes = extra_includes or []
@@ -112,28 +188,50 @@ class MakeStub():
         extra_cflags = extra_cflags or []
         extra_sources = extra_sources or []
 
-        print("""
-.global _start
-.extern function
+        c_code = '\n'.join(['#include '+i for i in self.includes + extra_includes] + [c_code])
 
-_start:
-    bl function
-    bkpt
-""", file=open(tmpdir+'/call.S','w'))
+        cflags = self.cflags
+        objcopy_flags = []
+        if function_addr is not None:
+            cflags = [f for f in cflags
+                      if not f.startswith(('-Wl,-Ttext,', '-Wl,-Tdata,'))]
+            cflags += ['-Wl,-Ttext,0x%x'%function_addr, '-Wl,-N']
+            objcopy_flags = ['--set-section-flags', '.bss=alloc,load,contents']
+
+        flags = (cflags + extra_cflags +
+                 ['-D%s'%d for d in self.defines+extra_defines] +
+                 ['-I%s'%i for i in self.include_path+extra_include_path] +
+                 ['-g3'])
+        sources = self.sources + extra_sources
+
+        version = toolchain_version()
+
+        key = None
+        if self.cache:
+            key = cache.hash_key(
+                c_code, CALL_S, flags, objcopy_flags,
+                resolve_includes(c_code, self.include_path+extra_include_path),
+                [open(f, 'rb').read() for f in sources],
+                version)
+            stub = self.cache.get(key)
+            if stub is not None:
+                return stub
 
-        c_code = '\n'.join(['#include '+i for i in self.includes + extra_includes] + [c_code])
+        if 1:
+            tmpdir = tempfile.mkdtemp(prefix='svd_gdb_')
+        else:
+            tmpdir = "/tmp/current"
+
+        print(CALL_S, file=open(tmpdir+'/call.S','w'))
 
         print(c_code, file=open(tmpdir+'/function.c','w'))
 
         cc_args = ([CC] +
-                   self.cflags + extra_cflags +
-                   ['-D%s'%d for d in self.defines+extra_defines] +
-                   ['-I%s'%i for i in self.include_path+extra_include_path] +
-                   ['-g3'] +
+                   flags +
                    ['-o',tmpdir+'/a.out'] +
                    [tmpdir+'/call.S'] +
                    [tmpdir+'/function.c'] +
-                   self.sources + extra_sources)
+                   sources)
         try:
             subprocess.check_output(cc_args)
         except subprocess.CalledProcessError:
@@ -141,6 +239,7 @@ _start:
             raise
 
         oc_args = (['arm-none-eabi-objcopy'] +
+                   objcopy_flags +
                    ['-O','binary'] +
                    [tmpdir+'/a.out'] +
                    [tmpdir+'/stub.bin'])
@@ -149,8 +248,100 @@ _start:
 
         # If error, we leak a directory.  On purpose, for debugging
         shutil.rmtree(tmpdir)
+
+        if key:
+            self.cache.put(key, stub)
         return stub
 
+    @property
+    def executor(self):
+        """Thread pool for submit(), one thread per CPU.  Threads are
+        enough since the work happens in gcc processes."""
+        if self._executor is None:
+            import concurrent.futures
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 1)
+        return self._executor
+
+    def submit(self, c_code, **kwargs):
+        """Starts building a stub in the background.  Takes the same
+        arguments as calling self, returns a concurrent.futures.Future
+        of the stub."""
+        return self.executor.submit(self, c_code, **kwargs)
+
+    def compile_many(self, jobs):
+        """Builds several stubs in parallel.  jobs is a list of C code
+        strings or (c_code, kwargs) tuples.  Returns the stubs in the
+        same order."""
+        futures = []
+        for job in jobs:
+            if isinstance(job, str):
+                futures.append(self.submit(job))
+            else:
+                futures.append(self.submit(job[0], **job[1]))
+        return [f.result() for f in futures]
+
+    def use_svd_header(self, device=None):
+        """Builds stubs against a C header generated from the SVD (see
+        svd_header.py) instead of the vendor SDK headers, which are
+        dropped from the include path.
+
+        The header is precompiled once per device, compiler and
+        flags, and kept in the cache directory."""
+        from . import svd_header
+
+        header = svd_header.device_header(device or self.device)
+        flags = ([f for f in self.cflags if not f.startswith('-Wl,')] +
+                 ['-D%s'%d for d in self.defines] +
+                 ['-g3'])
+        key = cache.hash_key(header, flags, toolchain_version())
+        d = cache.cache_dir('headers', key)
+        filename = os.path.join(d, 'svd_device.h')
+
+        if not os.path.exists(filename + '.gch'):
+            cache.atomic_write(filename, header.encode())
+            fd, tmp = tempfile.mkstemp(dir=d, prefix='.tmp_')
+            os.close(fd)
+            cc_args = [CC] + flags + ['-x', 'c-header', filename, '-o', tmp]
+            try:
+                subprocess.check_output(cc_args)
+            except subprocess.CalledProcessError:
+                print("Command was:",' '.join(cc_args))
+                os.unlink(tmp)
+                raise
+            os.replace(tmp, filename + '.gch')
+
+        self.include_path = [d]
+        self.includes = ['"svd_device.h"']
+
+    def resident(self, c_code, **kwargs):
+        """Returns a ResidentStub, for gdb.Target.run_resident().
+        Arguments are the same as for calling self."""
+        return ResidentStub(self, c_code, kwargs)
+
+class ResidentStub():
+    """A stub that can be linked at any address in RAM.
+
+    gdb.Target.run_resident() places it, and leaves it there for the
+    next call.  Builds for each address are kept."""
+
+    def __init__(self, make_stub, c_code, kwargs):
+        self.make_stub = make_stub
+        self.c_code = c_code
+        self.kwargs = kwargs
+        self.builds = {}
+
+        stub = self.build(make_stub.function_addr)
+        self.key = cache.hash_key(stub)
+        self.size = len(stub)
+
+    def build(self, address):
+        if address not in self.builds:
+            self.builds[address] = self.make_stub(self.c_code,
+                                                  function_addr=address,
+                                                  **self.kwargs)
+        return self.builds[address]
+
 def example_nRF_stub(d, *args, **kwargs):
     """Example stub function.
 
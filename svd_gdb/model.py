@@ -0,0 +1,540 @@
+#!/usr/bin/python3
+
+"""Device model compiled from an SVD file.
+
+parse() reads the XML into a Model: the device's peripherals, and
+flat tables of its clusters, registers and fields.  A table row is
+one declaration in the SVD, with the SVD's spellings already decoded
+(bit ranges, dim/dimIndex, number formats, inherited size, access
+and resetValue).  Numbers are kept in arrays, so a big SVD costs a
+few bytes per register and field rather than a dict each.
+svd_gdb.Device makes its objects as views on these rows.
+
+The XML is read in one pass with expat and no element tree is built.
+Descriptions are not kept, only their byte span in the file, and
+Model.description() reads the text back when it is wanted, from the
+file it keeps open for that.
+
+load() keeps the model in an on-disk cache (see cache.py),
+marshalled and keyed by the SVD contents and MODEL_VERSION, so a
+process that has seen the file before does not parse XML at all.
+
+Bump MODEL_VERSION whenever the model's contents change.
+"""
+
+import sys
+import array
+import marshal
+import weakref
+
+from . import cache
+
+MODEL_VERSION = 4
+
+# Register and field access, stored as the index
+ACCESS = (None, 'read-only', 'write-only', 'read-write',
+          'writeOnce', 'read-writeOnce')
+
+def int0(s):
+    s = s.lower()
+    if s.startswith('0x'):
+        return int(s,16)
+    else:
+        return int(s)
+
+def bool0(s):
+    s = s.lower().strip()
+    return s in ['1','true']
+
+def normalize(x):
+    "Text with runs of whitespace made single spaces"
+    if x is not None: # Yep, Element.text returns None for zero-length string.
+        x = x.strip()
+        x = ' '.join(x.split()) # Remove weird whitespace
+    return x
+
+def intern_name(x):
+    "Normalized and interned, since many rows share a name"
+    x = normalize(x)
+    return sys.intern(x) if x is not None else x
+
+def dim(v):
+    "(dim, dimIncrement, dimIndex list) or None, from element values v"
+    d = v.get('dim')
+    if d is None:
+        return None
+    d = int0(d)
+    dimIncrement = int0(v['dimIncrement'])
+
+    t = v.get('dimIndex')
+    if t is not None:
+        t = t.strip()
+        if "," in t:
+            dimIndex = t.split(',')
+        elif "-" in t:
+            first,last = t.split("-")
+            dimIndex = [str(x) for x in range(int(first),1+int(last))]
+    else:
+        dimIndex = [str(x) for x in range(d)]
+
+    assert len(dimIndex) == d
+    return (d, dimIncrement, dimIndex)
+
+def bit_range(v):
+    "(bit offset, bit width) from a field's values v"
+    if 'bitOffset' in v:
+        bit_offset = int0(v['bitOffset'])
+        bit_width = int0(v['bitWidth'])
+    elif 'lsb' in v:
+        bit_offset = int0(v['lsb'])
+        bit_width = 1 + int0(v['msb']) - bit_offset
+    elif 'bitRange' in v:
+        'A string in the format: "[<msb>:<lsb>]"'
+        s = v['bitRange'].strip()
+        assert s[0]=='['
+        assert s[-1]==']'
+        msb,lsb = s[1:-1].split(':')
+        bit_offset = int0(lsb)
+        bit_width = 1 + int0(msb) - bit_offset
+    else:
+        assert False
+    assert bit_width >= 1
+    return bit_offset, bit_width
+
+NO_SPAN = (0, 0)
+
+class Table():
+    """Columns of one kind of model object.  Row i is one declaration
+    in the SVD; dim elements and derivedFrom copies share it.
+    Numeric columns are arrays, the rest lists."""
+
+    columns = {}
+
+    def __init__(self, columns=None):
+        if columns is None:
+            for name, typecode in self.columns.items():
+                setattr(self, name, array.array(typecode) if typecode else [])
+        else:
+            for name, typecode in self.columns.items():
+                x = columns[name]
+                if typecode:
+                    x = array.array(typecode, x)
+                setattr(self, name, x)
+
+    def __len__(self):
+        return len(self.name)
+
+    def append(self, **row):
+        for name, value in row.items():
+            getattr(self, name).append(value)
+        return len(self) - 1
+
+    def dump(self):
+        "Columns for marshal, arrays as bytes"
+        return {name: (getattr(self, name).tobytes() if typecode
+                       else getattr(self, name))
+                for name, typecode in self.columns.items()}
+
+class Registers(Table):
+    columns = {'name': None,
+               'desc_start': 'I', # byte span of <description>
+               'desc_end': 'I',
+               'dim': None,
+               'offset': 'I', # from the parent
+               'size': 'B', # bits
+               'access': 'B', # ACCESS index
+               'reset': 'Q', # <size>64</size> registers exist
+               'field0': 'I', # first row in Fields
+               'nfields': 'H'}
+
+class Clusters(Table):
+    columns = {'name': None,
+               'desc_start': 'I',
+               'desc_end': 'I',
+               'dim': None,
+               'offset': 'I',
+               'registers': None, # row lists
+               'clusters': None}
+
+class Fields(Table):
+    columns = {'name': None,
+               'desc_start': 'I',
+               'desc_end': 'I',
+               'dim': None,
+               'bit_offset': 'B',
+               'bit_width': 'B',
+               'access': 'B',
+               'enum': None} # [(value, name, description span)] or None
+
+class Model():
+    def __init__(self, m=None):
+        "m is the output of dump(), or None for an empty model"
+        if m is None:
+            m = {'name': None, 'cpu': None, 'encoding': None, 'peripherals': [],
+                 'registers': None, 'clusters': None, 'fields': None}
+        self.name = m['name']
+        self.cpu = m['cpu']
+        self.encoding = m['encoding'] # from the XML declaration
+        self.peripherals = m['peripherals']
+        self.registers = Registers(m['registers'])
+        self.clusters = Clusters(m['clusters'])
+        self.fields = Fields(m['fields'])
+
+        self._layouts = {}
+        self.enums = {} # svd_gdb.Enumeration by field row
+
+        # SVD bytes or filename, for description()
+        self.source = None
+        self._file = None # source, kept open for the next description()
+
+    def dump(self):
+        return marshal.dumps({'name': self.name,
+                              'cpu': self.cpu,
+                              'encoding': self.encoding,
+                              'peripherals': self.peripherals,
+                              'registers': self.registers.dump(),
+                              'clusters': self.clusters.dump(),
+                              'fields': self.fields.dump()})
+
+    def descriptions(self, spans, how=normalize):
+        """Text of the <description> elements at spans, read back from
+        the SVD.  how is applied to each; None for a missing element,
+        or if the file can not be read any more."""
+        src = self.source
+        try:
+            if isinstance(src, bytes):
+                frags = [src[start:end] for start, end in spans]
+            else:
+                # _description of one object after another, as help()
+                # and __repr__ do, should not be an open() each
+                f = self._file
+                if f is None or f.name != src:
+                    self.close()
+                    f = self._file = open(src, 'rb')
+                    # closed with the model, if not before
+                    self._closer = weakref.finalize(self, f.close)
+                frags = []
+                for start, end in spans:
+                    f.seek(start)
+                    frags.append(f.read(end - start))
+        except (OSError, TypeError):
+            self.close()
+            return [None] * len(spans)
+
+        import xml.etree.ElementTree as ET
+        encoding = self.encoding or 'utf-8'
+        decl = b'<?xml version="1.0" encoding="%s"?>'%encoding.encode()
+        ret = []
+        for frag in frags:
+            if not frag or frag.endswith(b'/>'):
+                ret.append(None)
+                continue
+            text = None
+            if frag.startswith(b'<description>') and b'&' not in frag:
+                # Plain text, as most are; no need to parse it
+                text = frag[13:]
+                if text and b'<' not in text and b'\r' not in text:
+                    try:
+                        text = text.decode(encoding)
+                    except (LookupError, UnicodeDecodeError):
+                        text = None
+                else:
+                    text = None
+            if text is None:
+                text = ET.fromstring(decl + frag + b'</description>').text
+            ret.append(how(text))
+        return ret
+
+    def close(self):
+        "Closes the SVD file kept open by descriptions()"
+        if self._file is not None:
+            self._closer()
+            self._file = None
+
+    def description(self, span, how=normalize):
+        return self.descriptions([span], how)[0]
+
+    def table(self, kind):
+        "kind is 'registers', 'clusters' or 'fields'"
+        return getattr(self, kind)
+
+    def children(self, kind, rows):
+        """[(kind, row, r, name)] for the objects made from rows.  r is
+        the dim index, or None for a plain object or a whole
+        NAME[%s] array."""
+        t = self.table(kind)
+        ret = []
+        for i in rows:
+            name = t.name[i]
+            d = t.dim[i]
+            if d is None:
+                ret.append((kind, i, None, name))
+            elif name.endswith('[%s]'):
+                ret.append((kind, i, None, name[:-4]))
+            else:
+                ret += [(kind, i, r, name % x) for r, x in enumerate(d[2])]
+        return ret
+
+    def peripheral_index(self):
+        "Peripheral name -> position in peripherals"
+        ret = self._layouts.get('peripheral_index')
+        if ret is None:
+            ret = self._layouts['peripheral_index'] = {
+                p['name']: i for i, p in enumerate(self.peripherals)}
+        return ret
+
+    def base(self, i):
+        "Position of the peripheral that peripheral i is derivedFrom, or None"
+        df = self.peripherals[i]['derivedFrom']
+        if df:
+            return self.peripheral_index()[df]
+        return None
+
+    def layout(self, kind, i):
+        """Children of peripheral, cluster or register i, as (entries,
+        index) where index maps each name to its position in entries.
+
+        Made once and shared by every object with that row: dim
+        elements, and derivedFrom peripherals that add no registers
+        of their own, which differ only by base address.  A derived
+        peripheral that does add registers gets the base's entries
+        followed by its own, whose names win."""
+        ret = self._layouts.get((kind, i))
+        if ret is None:
+            if kind == 'registers':
+                r = self.registers
+                entries = self.children('fields', range(r.field0[i],
+                                                        r.field0[i] + r.nfields[i]))
+            elif kind == 'clusters':
+                c = self.clusters
+                entries = (self.children('registers', c.registers[i]) +
+                           self.children('clusters', c.clusters[i]))
+            else:
+                p = self.peripherals[i]
+                entries = (self.children('registers', p['registers']) +
+                           self.children('clusters', p['clusters']))
+                base = self.base(i)
+                if base is not None:
+                    if not entries:
+                        ret = self.layout('peripherals', base)
+                    else:
+                        entries = list(self.layout('peripherals', base)[0]) + entries
+            if ret is None:
+                ret = make_layout(entries)
+            self._layouts[(kind, i)] = ret
+        return ret
+
+def make_layout(entries):
+    entries = tuple(entries)
+    return (entries, {e[3]: j for j, e in enumerate(entries)})
+
+class Parser():
+    """Builds a Model from expat callbacks.
+
+    Only the elements enclosing the current one are kept, each as a
+    frame [tag, attributes, text, values].  values holds the text of
+    the element's leaf children by tag (the first one, like
+    Element.find()), and the frame's own bookkeeping under keys
+    starting with '.'.  Objects go into the model as their element
+    ends, and the frame is dropped."""
+
+    def __init__(self):
+        self.m = Model()
+        self.stack = []
+
+    def parse(self, data):
+        import xml.parsers.expat
+
+        p = self.p = xml.parsers.expat.ParserCreate()
+        p.buffer_text = True
+        p.XmlDeclHandler = self.xml_decl
+        p.StartElementHandler = self.start
+        p.EndElementHandler = self.end
+        p.CharacterDataHandler = self.chars
+        p.Parse(data, True)
+        return self.m
+
+    def xml_decl(self, version, encoding, standalone):
+        self.m.encoding = encoding
+
+    def chars(self, data):
+        self.stack[-1][2].append(data)
+
+    def start(self, tag, attrib):
+        v = {}
+        if self.stack:
+            parent = self.stack[-1]
+            parent[3]['.parent'] = True
+            if tag == 'description':
+                v['.start'] = self.p.CurrentByteIndex
+            elif tag == 'register':
+                v['.field0'] = len(self.m.fields)
+            elif tag in ('peripheral', 'cluster'):
+                v['.registers'] = []
+                v['.clusters'] = []
+            elif tag == 'enumeratedValues':
+                # Only the first set, like Element.find()
+                if '.enum' in parent[3]:
+                    v['.skip'] = True
+                else:
+                    parent[3]['.enum'] = []
+        self.stack.append([tag, attrib, [], v])
+
+    def properties(self, v):
+        "registerPropertiesGroup of v, defaulting to the enclosing elements'"
+        ret = {'size': 32, 'access': 0, 'reset': 0}
+        for f in self.stack:
+            self.own_properties(f[3], ret)
+        self.own_properties(v, ret)
+        return ret
+
+    def own_properties(self, v, ret):
+        if 'size' in v:
+            ret['size'] = int0(v['size'])
+        if 'access' in v:
+            ret['access'] = ACCESS.index(v['access'].strip())
+        if 'resetValue' in v:
+            ret['reset'] = int0(v['resetValue'])
+
+    def end(self, tag):
+        tag, attrib, text, v = self.stack.pop()
+        if not self.stack:
+            self.m.name = v['name'].strip()
+            return
+        parent = self.stack[-1]
+        ptag = parent[0]
+        pv = parent[3]
+
+        if tag == 'description':
+            pv.setdefault('description', (v['.start'], self.p.CurrentByteIndex))
+        elif '.parent' not in v:
+            pv.setdefault(tag, ''.join(text) if text else None)
+        elif tag == 'enumeratedValue':
+            if ptag == 'enumeratedValues' and '.skip' not in pv:
+                self.enumerated_value(v, self.stack[-2][3]['.enum'])
+        elif tag == 'field':
+            if ptag == 'fields':
+                self.field(attrib, v)
+        elif tag == 'register':
+            c = self.container()
+            if c is not None:
+                c['.registers'].append(self.register(v))
+        elif tag == 'cluster':
+            c = self.container()
+            if c is not None:
+                c['.clusters'].append(self.cluster(v))
+        elif tag == 'peripheral':
+            if ptag == 'peripherals':
+                self.m.peripherals.append(self.peripheral(attrib, v))
+        elif tag == 'cpu':
+            if ptag == 'device':
+                self.m.cpu = {'name': v['name'].strip()}
+
+    def container(self):
+        "Values of the cluster or peripheral a register/cluster belongs to"
+        parent = self.stack[-1]
+        if parent[0] == 'cluster':
+            return parent[3]
+        if (parent[0] == 'registers' and len(self.stack) > 1 and
+            self.stack[-2][0] == 'peripheral'):
+            return self.stack[-2][3]
+        return None
+
+    def enumerated_value(self, v, enum):
+        name = v['name'].strip()
+        d = v.get('description', NO_SPAN)
+        value = v.get('value')
+        if value is None:
+            isd = v.get('isDefault')
+            if isd is not None and bool0(isd):
+                enum.append((None, name, d))
+        else:
+            enum.append((value.strip(), name, d))
+
+    def field(self, attrib, v):
+        # Deal with derived fields when we actually find an
+        # SVD with derived field.
+        assert attrib.get('derivedFrom',None) is None
+
+        bit_offset, bit_width = bit_range(v)
+        d = v.get('description', NO_SPAN)
+        return self.m.fields.append(name=intern_name(v.get('name')),
+                                    desc_start=d[0],
+                                    desc_end=d[1],
+                                    dim=dim(v),
+                                    bit_offset=bit_offset,
+                                    bit_width=bit_width,
+                                    access=self.properties(v)['access'],
+                                    enum=v.get('.enum') or None)
+
+    def register(self, v):
+        props = self.properties(v)
+        d = v.get('description', NO_SPAN)
+        field0 = v['.field0']
+        return self.m.registers.append(name=intern_name(v.get('name')),
+                                       desc_start=d[0],
+                                       desc_end=d[1],
+                                       dim=dim(v),
+                                       offset=int0(v['addressOffset']),
+                                       size=props['size'],
+                                       access=props['access'],
+                                       reset=props['reset'],
+                                       field0=field0,
+                                       nfields=len(self.m.fields) - field0)
+
+    def cluster(self, v):
+        d = v.get('description', NO_SPAN)
+        return self.m.clusters.append(name=intern_name(v.get('name')),
+                                      desc_start=d[0],
+                                      desc_end=d[1],
+                                      dim=dim(v),
+                                      offset=int0(v['addressOffset']),
+                                      registers=v['.registers'],
+                                      clusters=v['.clusters'])
+
+    def peripheral(self, attrib, v):
+        ret = {'name': v['name'].strip(),
+               'derivedFrom': attrib.get('derivedFrom',None),
+               'baseAddress': int0(v['baseAddress']),
+               'registers': v['.registers'],
+               'clusters': v['.clusters']}
+        if 'description' in v: # derived peripherals keep the base's otherwise
+            ret['description'] = v['description']
+        return ret
+
+def parse(data):
+    "Model of the SVD in data (bytes)"
+    m = Parser().parse(data)
+    m.source = data
+    return m
+
+def load(filename, model_cache=True):
+    """Model of the SVD file, from the cache if it has been parsed before.
+
+    model_cache is a cache.FileCache, True for the default
+    cache.ModelCache(), or False to always parse."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    if model_cache is True:
+        model_cache = cache.ModelCache()
+    if not model_cache:
+        m = parse(data)
+        m.source = filename
+        return m
+
+    key = cache.hash_key(data, MODEL_VERSION, marshal.version, sys.byteorder)
+    m = model_cache.get(key)
+    if m is not None:
+        try:
+            ret = Model(marshal.loads(m))
+        except (EOFError, ValueError, TypeError, KeyError):
+            ret = None # damaged entry, parse again
+        if ret is not None:
+            ret.source = filename
+            return ret
+
+    ret = parse(data)
+    model_cache.put(key, ret.dump())
+    ret.source = filename
+    return ret
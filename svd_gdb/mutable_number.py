@@ -20,7 +20,11 @@ class MutableNumber(numbers.Integral):
     The current immutable number is the '_n' attribute, and all the
     numeric type dunder methods just delegate to this current number.
 
+    Subclasses that define __slots__, and a property for '_n', get
+    instances without a __dict__.
+
     """
+    __slots__ = ('_n',)
 
     # Basic customization
     def __init__(self, n=None): self._n=n
@@ -102,6 +106,7 @@ class MutableNumber(numbers.Integral):
     def __round__(self, n=0): return round(self._n, n)
 
 class MutableInteger(MutableNumber):
+    __slots__ = ()
 
     def __lshift__(self, other): return self._n << other
     def __rshift__(self, other): return self._n >> other
@@ -145,6 +150,7 @@ class MutableInteger(MutableNumber):
 
 class MutableFloat(MutableNumber):
     """ Add some float operations """
+    __slots__ = ()
 
     def conjugate(self): return self._n.conjugate()
 
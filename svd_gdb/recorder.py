@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+"""Records register accesses made through a Device, and turns them
+into a stub that replays them at full speed.
+
+Each register access from Python is a probe round trip.  An init
+sequence worked out interactively can be recorded once and then run
+as a single stub call:
+
+ >>> with d._record() as rec:
+ ...     d.SAADC.ENABLE = 1
+ ...     d.SAADC.TASKS_CALIBRATEOFFSET = 1
+ ...     while not d.SAADC.EVENTS_CALIBRATEDONE: pass
+ >>> print(rec.c_code())
+ >>> rec.replay()
+
+Repeated reads of one register are taken as a polling loop, which
+waits until the bits that changed reach their final value.  Other
+reads are dropped unless keep_reads is set, since most come from
+looking at registers rather than from the sequence itself.  A poll
+that succeeds on its first read can not be told from a plain read.
+"""
+
+# Polls give up after this many reads; the stub then returns the
+# 1-based number of the step that timed out.
+POLL_LIMIT = 1000000
+
+class Recording():
+    def __init__(self, device, keep_reads=False):
+        self.device = device
+        self.keep_reads = keep_reads
+        self.ops = [] # raw accesses, in order
+        self._saved = None
+
+    # Recording
+
+    def __enter__(self):
+        gdb = self.device._gdb
+        self._saved = {}
+        self._depth = 0
+        for name in ('read32', 'write32', 'set_bit', 'clear_bit', 'is_bit_set'):
+            self._saved[name] = gdb.__dict__.get(name)
+            setattr(gdb, name, self._wrap(name, getattr(gdb, name)))
+        return self
+
+    def __exit__(self, *exc):
+        gdb = self.device._gdb
+        for name, orig in self._saved.items():
+            if orig is None:
+                delattr(gdb, name)
+            else:
+                setattr(gdb, name, orig)
+        self._saved = None
+
+    def _wrap(self, name, f):
+        def wrapper(address, *args):
+            # set_bit() etc. may be read-modify-write through read32()
+            # and write32(); record only the outer access.
+            self._depth += 1
+            try:
+                ret = f(address, *args)
+            finally:
+                self._depth -= 1
+            if not self._depth:
+                if name == 'read32' or name == 'is_bit_set':
+                    self.ops.append((name, int(address)) + tuple(args) + (int(ret),))
+                else:
+                    self.ops.append((name, int(address)) + tuple(int(a) for a in args))
+            return ret
+        return wrapper
+
+    # Script
+
+    def script(self):
+        """Recorded accesses as a list of steps:
+
+        ('write', address, value)
+        ('set_bit', address, bit)
+        ('clear_bit', address, bit)
+        ('wait', address, mask, value) -- until (*address & mask) == value
+        ('read', address)               -- only with keep_reads
+        """
+        ret = []
+        ops = self.ops
+        i = 0
+        while i < len(ops):
+            op = ops[i]
+            j = i + 1
+            while j < len(ops) and ops[j][:-1] == op[:-1] and op[0] in ('read32', 'is_bit_set'):
+                j += 1
+            run = ops[i:j]
+            i = j
+
+            if op[0] == 'write32':
+                ret.append(('write', op[1], op[2]))
+            elif op[0] in ('set_bit', 'clear_bit'):
+                ret.append(op)
+            elif op[0] == 'read32':
+                last = run[-1][2]
+                mask = 0
+                for r in run:
+                    mask |= r[2] ^ last
+                if mask:
+                    ret.append(('wait', op[1], mask, last & mask))
+                elif self.keep_reads:
+                    ret.append(('read', op[1]))
+            elif op[0] == 'is_bit_set':
+                bit = op[2]
+                if len(set(r[3] for r in run)) > 1:
+                    ret.append(('wait', op[1], 1 << bit, run[-1][3] << bit))
+                elif self.keep_reads:
+                    ret.append(('read', op[1]))
+        return ret
+
+    def register_name(self, address):
+        "SVD name of the register at address, or None"
+        for r in self.device._registers_at(address):
+            if r._addr == address:
+                return r._repr_no_get().split('.', 1)[-1]
+        return None
+
+    def c_code(self):
+        "Stub source replaying script().  Returns 0, or the failed step."
+        lines = ['#include <stdint.h>',
+                 '',
+                 '#define REG(a) (*(volatile uint32_t *)(a))',
+                 '',
+                 'uint32_t function(void) {',
+                 '    uint32_t n;']
+        for step, s in enumerate(self.script(), 1):
+            op, address = s[:2]
+            reg = 'REG(0x%08xUL)'%address
+            name = self.register_name(address)
+            comment = ' /* %s */'%name if name else ''
+            if op == 'write':
+                lines.append('    %s = 0x%08xUL;%s'%(reg, s[2], comment))
+            elif op == 'set_bit':
+                lines.append('    %s |= 1UL << %d;%s'%(reg, s[2], comment))
+            elif op == 'clear_bit':
+                lines.append('    %s &= ~(1UL << %d);%s'%(reg, s[2], comment))
+            elif op == 'read':
+                lines.append('    (void)%s;%s'%(reg, comment))
+            elif op == 'wait':
+                lines.append('    for (n = 0; (%s & 0x%08xUL) != 0x%08xUL; n++)%s'%(
+                    reg, s[2], s[3], comment))
+                lines.append('        if (n == %d) return %d;'%(POLL_LIMIT, step))
+        lines += ['    return 0;', '}']
+        return '\n'.join(lines) + '\n'
+
+    # Replay
+
+    def stub(self, make_stub=None):
+        "Compiles c_code(), by default with the device's MakeStub"
+        make_stub = make_stub or self.device._gdb.make_stub
+        return make_stub(self.c_code())
+
+    def replay(self, timeout=3, make_stub=None):
+        "Runs the recorded sequence on the target as one stub call"
+        make_stub = make_stub or self.device._gdb.make_stub
+        target = self.device._gdb.gdb
+        target.run_stub_timeout(timeout, self.stub(make_stub),
+                                make_stub.function_addr)
+        result = target.read_reg(0)
+        if result:
+            raise Exception('Replay timed out polling at step %d: %r'%(
+                result, self.script()[result - 1]))
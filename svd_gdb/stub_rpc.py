@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+"""Resident stub that takes batches of calls through a RAM mailbox.
+
+Every gdb.Target.run_stub_timeout() call sets up the core registers
+from scratch, which is several round trips before any work is done.
+For many small calls (toggle a pin, clock a byte out), build the
+functions into one stub with a dispatcher loop instead.  The host
+queues calls, writes the whole batch to the mailbox in one packet,
+resumes the target once and reads all the results back in one read.
+
+The C code defines any number of functions taking up to four
+uint32_t arguments and returning uint32_t.  The name 'function' is
+taken by the dispatcher.
+
+ >>> rpc = stub_rpc.StubRpc(d._gdb.gdb, d._gdb.make_stub, '''
+ ... uint32_t add(uint32_t a, uint32_t b) { return a + b; }
+ ... ''', ['add'])
+ >>> rpc.call('add', 1, 2)
+ 0
+ >>> rpc.call('add', 3, 4)
+ 1
+ >>> rpc.flush()
+ [3, 7]
+
+"""
+
+import struct
+
+DISPATCHER = """
+#include <stdint.h>
+
+typedef uint32_t (*rpc_function_t)(uint32_t, uint32_t, uint32_t, uint32_t);
+
+struct rpc_call {
+    uint32_t index;
+    uint32_t args[4];
+    uint32_t result;
+};
+
+struct rpc_mailbox {
+    uint32_t count;
+    uint32_t done;
+    struct rpc_call calls[];
+};
+
+%(c_code)s
+
+static rpc_function_t const rpc_table[] = {
+%(table)s
+};
+
+void function(volatile struct rpc_mailbox *mb) {
+    uint32_t i;
+    volatile struct rpc_call *c;
+
+    for (;;) {
+        for (i = 0; i < mb->count; i++) {
+            c = &mb->calls[i];
+            c->result = rpc_table[c->index](c->args[0], c->args[1],
+                                            c->args[2], c->args[3]);
+        }
+        mb->done = mb->count;
+        __asm__ volatile ("bkpt");
+    }
+}
+"""
+
+CALL_SIZE = 24
+
+class StubRpc():
+    def __init__(self, target, make_stub, c_code, functions,
+                 mailbox=None, max_calls=64, timeout=3, **stub_kwargs):
+        """target is a gdb.Target, make_stub a make_stub.MakeStub.
+
+        functions lists the names in c_code that can be called.  The
+        mailbox goes at the top of the stub's data area unless given."""
+
+        self.target = target
+        self.functions = list(functions)
+        self.index = {name: i for i, name in enumerate(self.functions)}
+        table = '\n'.join('    (rpc_function_t)%s,'%name
+                          for name in self.functions)
+        self.stub = make_stub(DISPATCHER % {'c_code': c_code,
+                                            'table': table},
+                              **stub_kwargs)
+        self.address = make_stub.function_addr
+        self.mailbox = mailbox if mailbox is not None else make_stub.heap_addr
+        self.max_calls = max_calls
+        self.timeout = timeout
+        self.queue = []
+
+        # Set if the probe resumes onto the BKPT instead of past it
+        self.step_bkpt = False
+
+    def call(self, name, *args):
+        """Queues a call.  Returns its position in the results of
+        the next flush()."""
+        assert len(args) <= 4
+        if len(self.queue) == self.max_calls:
+            raise Exception('RPC queue full, flush() first')
+        self.queue.append((self.index[name],) +
+                          tuple(args) + (0,) * (4 - len(args)))
+        return len(self.queue) - 1
+
+    def _kick(self):
+        target = self.target
+        if self.step_bkpt:
+            target.write_reg(15, target.read_reg(15) + 2)
+        target.resume()
+        target.await_stop_response('SIGTRAP', timeout=self.timeout)
+
+    def flush(self):
+        "Runs all queued calls on the target, returns their results"
+        queue = self.queue
+        self.queue = []
+        if not queue:
+            return []
+
+        target = self.target
+        n = len(queue)
+        data = struct.pack('<II', n, 0xffffffff)
+        for call in queue:
+            data += struct.pack('<6I', *(call + (0,)))
+        target.write_mem(self.mailbox, data)
+
+        if target.resident_rpc is self:
+            self._kick()
+        else:
+            target.run_stub_timeout(self.timeout, self.stub, self.address,
+                                    self.mailbox)
+            target.resident_rpc = self
+
+        raw = target.read_mem(self.mailbox + 4, 4 + n * CALL_SIZE)
+        done, = struct.unpack_from('<I', raw)
+        if done != n and not self.step_bkpt:
+            # The probe did not step over the BKPT, so the target
+            # stopped again without running the batch.
+            self.step_bkpt = True
+            self._kick()
+            raw = target.read_mem(self.mailbox + 4, 4 + n * CALL_SIZE)
+            done, = struct.unpack_from('<I', raw)
+        if done != n:
+            target.resident_rpc = None
+            raise Exception('RPC stub did not run the batch')
+
+        return [struct.unpack_from('<I', raw, 4 + i * CALL_SIZE + 20)[0]
+                for i in range(n)]
@@ -1,18 +1,9 @@
 #!/usr/bin/python3
 
-import xml.etree.ElementTree as ET
 import textwrap
 
-def int0(s):
-    s = s.lower()
-    if s.startswith('0x'):
-        return int(s,16)
-    else:
-        return int(s)
-
-def bool0(s):
-    s = s.lower().strip()
-    return s in ['1','true']
+from . import model
+from .model import int0, bool0
 
 from .mutable_number import MutableInteger
 class Int32(int):
@@ -45,9 +36,20 @@ class IntX(int):
         return ret
 
 class EnumeratedValue():
-    def __init__(self, value, name, description):
-        "value is a string type, decoded into value and mask according to enumeratedValue rules"
-        if type(value)==str:
+    def __init__(self, value, name, description, bit_width=None, others=()):
+        """value is a string type, decoded into value and mask according
+        to enumeratedValue rules.  None is the isDefault value, which
+        stands for every bit_width bit value not in others.
+
+        Patterns like 0b1x0 are kept as _value with the x bits set in
+        _dont_care, not expanded, so they can be any width."""
+        self._value = None
+        self._dont_care = 0
+        self._default = value is None
+        if self._default:
+            self._bit_width = bit_width
+            self._others = others
+        else:
             value = value.lower()
             binvalue = None
             if value.startswith('0b'):
@@ -56,53 +58,108 @@ class EnumeratedValue():
                 binvalue = value[1:]
 
             if binvalue is None:
-                self._values = set((int0(value),))
+                self._value = int0(value)
             else:
-                def both(x):
-                    ret = []
-                    for y in x:
-                        if not 'x' in y:
-                            ret.append(y)
-                        else:
-                            ret += both([y.replace('x','0',1)])
-                            ret += both([y.replace('x','1',1)])
-                    return ret
-                self._values = set(int(x,2) for x in both([binvalue]))
-        else:
-            self._values = set(value)
+                self._value = int(binvalue.replace('x','0'),2)
+                self._dont_care = int(''.join('1' if c=='x' else '0'
+                                              for c in binvalue),2)
 
         self._name = name
         self._description = description
 
+    @property
+    def _values(self):
+        "Set of every value this stands for"
+        if self._default:
+            others = set()
+            for e in self._others:
+                others |= e._values
+            return set(range(1<<self._bit_width)) - others
+        ret = [self._value]
+        bit = 1
+        while bit <= self._dont_care:
+            if self._dont_care & bit:
+                ret += [v | bit for v in ret]
+            bit <<= 1
+        return set(ret)
+
+    def _single(self):
+        "The value, if this stands for exactly one, else None"
+        if self._default:
+            values = self._values if self._bit_width <= 16 else ()
+            return next(iter(values)) if len(values) == 1 else None
+        return self._value if not self._dont_care else None
+
     def __eq__(self, other):
-        return other in self._values
+        if self._default:
+            return (other in range(1<<self._bit_width) and
+                    not any(e == other for e in self._others))
+        try:
+            return (other & ~self._dont_care) == self._value
+        except TypeError:
+            return False
+
     def __int__(self):
-        return self._values[0]
+        return self._value
+
+# Patterns with up to this many x bits go into Enumeration's table
+ENUM_EXPAND_BITS = 8
+
+class Enumeration(list):
+    """EnumeratedValue list of a field, compiled to a dict from each
+    value to the first EnumeratedValue equal to it, so decode() does
+    not scan the list.  isDefault is not in the table but is what
+    decode() falls back on."""
+
+    def __init__(self, values):
+        super().__init__(values)
+        self._table = {}
+        self._default = None
+        self._scan = False # a pattern too wide for the table
+        for e in self:
+            if e._default:
+                self._default = e
+            elif bin(e._dont_care).count("1") <= ENUM_EXPAND_BITS:
+                for v in e._values:
+                    self._table.setdefault(v, e)
+            else:
+                self._scan = True
+
+    def decode(self, value):
+        "The EnumeratedValue for value, or None"
+        if self._scan:
+            for e in self:
+                if e == value:
+                    return e
+            return None
+        e = self._table.get(value)
+        d = self._default
+        if e is None and d is not None and value in range(1<<d._bit_width):
+            e = d # nothing else has value, as it is not in the table
+        return e
 
 class SvdObj():
-    _strfields = (('_name','name'),
-                  ('_description','description'))
-    _intfields = ()
+    """View of row _i of one of the model's tables, see model.py"""
+    __slots__ = ()
+    _kind = None # 'registers', 'clusters' or 'fields'
 
-    def __init__(self, svd, parent):
-        self._svd = svd
+    def __init__(self, parent, i, r=None):
         self._parent = parent
         self._gdb = parent._gdb
+        self._model = parent._model
+        self._i = i
+
+        t = self._model.table(self._kind)
+        name = t.name[i]
+        if r is not None: # dim element
+            name %= t.dim[i][2][r]
+        self._name = name
 
-        for attname, fieldname in self._strfields:
-            x = svd.find(fieldname)
-            if x is not None:
-                x = x.text
-                if x is not None: # Yep, Element.text returns None for zero-length string.
-                    x = x.strip()
-                    x = ' '.join(x.split()) # Remove weird whitespace
-            setattr(self, attname, x)
-
-        for attname, fieldname in self._intfields:
-            x = svd.find(fieldname)
-            if x is not None:
-                x = int0(x.text)
-            setattr(self, attname, x)
+    @property
+    def _description(self):
+        t = self._model.table(self._kind)
+        return self._model.description((t.desc_start[self._i],
+                                        t.desc_end[self._i]))
 
     def __repr__(self):
         return repr(self._parent)+'.'+self._name
@@ -110,7 +167,7 @@ class SvdObj():
 class CPU(SvdObj):
     def __init__(self, svd, parent):
         self._svd = svd
-        self._name = svd.find('name').text.strip()
+        self._name = svd['name']
     def __repr__(self):
         return self._name
 
@@ -152,61 +209,141 @@ class ElementGroup(tuple):
 
         return ret
 
-class Field(SvdObj, MutableInteger):
-    def __init__(self, svd, parent):
-        super().__init__(svd, parent)
-
-        self._bit_offset = 0
-        self._bit_width = 32
-
-        b1 = svd.find('bitOffset')
-        b2 = svd.find('lsb')
-        b3 = svd.find('bitRange')
-        if b1 is not None:
-            self._bit_offset = int0(b1.text)
-            self._bit_width = int0(svd.find('bitWidth').text)
-        elif b2 is not None:
-            self._bit_offset = int0(b2.text)
-            self._bit_width = 1 + int0(svd.find('msb').text) - self._bit_offset
-        elif b3 is not None:
-            'A string in the format: "[<msb>:<lsb>]"'
-            s = b3.text.strip()
-            assert s[0]=='['
-            assert s[-1]==']'
-            msb,lsb = s[1:-1].split(':')
-            self._bit_offset = int0(lsb)
-            self._bit_width = 1 + int0(msb) - self._bit_offset
+class LazyChildren():
+    """Registers, clusters and fields are made from the model the
+    first time they are touched, as an attribute or through a list
+    like _registers.  _layout() gives (entries, index): the (kind,
+    row, dim index, name) of every child, shared by all objects of
+    the same layout, and a name -> position map.  _objs holds the
+    children made so far, by position."""
+    __slots__ = ()
+
+    def _build(self, j):
+        entries = self._layout()[0]
+        objs = self._objs
+        if objs is None or len(objs) < len(entries):
+            objs = self._objs = (objs or []) + [None] * (len(entries) - len(objs or []))
+        obj = objs[j]
+        if obj is None:
+            obj = objs[j] = self._make(entries[j])
+        return obj
+
+    def _make(self, entry):
+        return make_child(self, *entry)
+
+    def _children(self, kind):
+        return [self._build(j)
+                for j, e in enumerate(self._layout()[0])
+                if e[0] == kind]
+
+    def _childmap(self, kind):
+        entries, index = self._layout()
+        return {name: self._build(j)
+                for name, j in index.items()
+                if entries[j][0] == kind}
+
+    def _child(self, kind, name):
+        "Like getattr(), but KeyError unless name is a child of that kind"
+        entries, index = self._layout()
+        j = index.get(name)
+        if j is None or entries[j][0] != kind:
+            raise KeyError(name)
+        return self._build(j)
+
+    def __getattr__(self, attname):
+        # Only called for names that are not real attributes
+        j = None
+        if not attname.startswith('_'):
+            j = self._layout()[1].get(attname)
+        if j is None:
+            raise AttributeError("%r object has no attribute %r"%(
+                self.__class__.__name__, attname))
+        return self._build(j)
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(self._layout()[1]))
+
+def make_child(parent, kind, i, r, name):
+    """Makes the object for a layout entry.
+
+    If there is no dim, just create a new object and return it.  If
+    there is a plain dim like NAME[%s] then we need to return
+    array-like, an ElementGroup.  If there is a dimIndex defined, each
+    element is its own entry, with r its index."""
+    cls = {'registers': Register,
+           'clusters': Cluster,
+           'fields': Field}[kind]
+    return make_elements(lambda r: cls(parent, i, r),
+                         parent._model.table(kind).dim[i], r, name)
+
+def make_elements(make, d, r, name):
+    """make(r) for dim element r, make(None) for an object without
+    dim d, or an ElementGroup of every element for a NAME[%s] array"""
+    if r is not None or d is None:
+        return make(r)
+    eg = ElementGroup(make(r) for r in range(d[0]))
+    eg._name = name
+    return eg
+
+def strip(x):
+    return x.strip() if x is not None else x
+
+def make_enum(m, enum, bit_width):
+    "EnumeratedValue list from a model.Fields enum column entry"
+    enum = enum or ()
+    descriptions = m.descriptions([e[2] for e in enum], strip)
+    return enumerated_values([(value, name, description)
+                              for (value, name, span), description
+                              in zip(enum, descriptions)], bit_width)
+
+def enumerated_values(enum, bit_width):
+    """Enumeration from [(value, name, description)], value as in the
+    SVD or None for isDefault"""
+    ret = []
+    default_value = None
+    for value, name, description in enum:
+        if value is None:
+            default_value = (name, description)
         else:
-            assert False
-        assert self._bit_width >= 1
-
-        self._enum = []
-        ev = svd.find('enumeratedValues')
-        if ev is not None:
-            default_value = None
-            for val in ev.findall('enumeratedValue'):
-                name = val.find('name').text.strip()
-                d = val.find('description')
-                if d is not None:
-                    d = d.text
-                    if d is not None:
-                        d = d.strip()
-                description = d
-
-                value = val.find('value')
-                if value is None:
-                    isd = val.find('isDefault')
-                    if isd is not None and bool0(isd.text):
-                        default_value = (name, description)
-                else:
-                    value = value.text.strip()
-                    self._enum.append(EnumeratedValue(value,name,description))
-            if default_value:
-                all_values = list(range(1<<self._bit_width))
-                for v in all_values:
-                    if v in self._enum:
-                        all_values.remove(v)
-                self._enum.append(EnumeratedValue(all_values,name,description))
+            ret.append(EnumeratedValue(value,name,description))
+    if default_value:
+        name, description = default_value
+        ret.append(EnumeratedValue(None,name,description,
+                                   bit_width,tuple(ret)))
+    return Enumeration(ret)
+
+class Field(SvdObj, MutableInteger):
+    __slots__ = ('_parent', '_gdb', '_model', '_i', '_name',
+                 '_bit_offset', '_bit_width')
+    _kind = 'fields'
+
+    def __init__(self, parent, i, r=None):
+        super().__init__(parent, i, r)
+
+        t = self._model.fields
+        self._bit_offset = t.bit_offset[i]
+        self._bit_width = t.bit_width[i]
+        if r is not None:
+            self._bit_offset += r*t.dim[i][1]
+
+    @property
+    def _enum(self):
+        "Enumeration, made once per model row"
+        enums = self._model.enums
+        ret = enums.get(self._i)
+        if ret is None:
+            ret = enums[self._i] = make_enum(self._model,
+                                             self._model.fields.enum[self._i],
+                                             self._bit_width)
+        return ret
+
+    def _enum_names(self):
+        "Names in _enum, without making it"
+        return [e[1] for e in self._model.fields.enum[self._i] or ()]
+
+    @property
+    def _access(self):
+        return model.ACCESS[self._model.fields.access[self._i]]
 
     def _set(self, value):
         if self._bit_width==1:
@@ -215,31 +352,29 @@ class Field(SvdObj, MutableInteger):
             else:
                 self._parent._clear_bit(self._bit_offset)
         elif self._bit_width==32:
-            self._parent_set(value)
+            self._parent._set(value)
         else:
             mask = ((1 << self._bit_width)-1) << self._bit_offset
-            x = self._parent._get()
+            x = self._parent._raw()
             x &= ~mask
             x |= value << self._bit_offset
             self._parent._set(x)
 
-    def _get(self):
+    def _raw(self):
+        "Value as a plain int, without looking up the enumeration"
         if self._bit_width==1:
-            ret = self._parent._is_bit_set(self._bit_offset)
-        elif self._bit_width==32:
-            ret = self._parent._get()
-        else:
-            mask = ((1 << self._bit_width)-1)
-            x = self._parent._get()
-            x >>= self._bit_offset
-            ret = x & mask
+            return int(self._parent._is_bit_set(self._bit_offset))
+        x = self._parent._raw()
+        return (x >> self._bit_offset) & ((1 << self._bit_width)-1)
 
-        try:
-            i = self._enum.index(ret)
-        except ValueError:
+    def _get(self):
+        ret = self._raw()
+
+        e = self._enum.decode(ret)
+        if e is None:
             return IntX(self._bit_width, ret)
 
-        extra = "(%s)"%self._enum[i]._name
+        extra = "(%s)"%e._name
         return IntX(self._bit_width, ret, extra=extra)
 
     @property
@@ -253,57 +388,80 @@ class Field(SvdObj, MutableInteger):
     def __repr__(self):
         return self._parent._repr_no_get()+'.'+self._name+' = '+repr(self._get())
 
-class FieldHaver():
+class FieldHaver(LazyChildren):
+    __slots__ = ()
+
     def __setattr__(self, attname, value):
-        if hasattr(self, '_freezeattr'): # avoid recursion
-            if attname != '_freezeattr':
-                if attname == '_n':
-                    self._set(value)
-                else:
-                    self._fieldmap[attname]._set(value)
-        else:
+        if attname == '_n':
+            self._set(value)
+        elif attname.startswith('_'):
             super().__setattr__(attname, value)
+        else:
+            self._child('fields', attname)._set(value)
 
 class Register(SvdObj, FieldHaver, MutableInteger):
-    _intfields = (('_address_offset','addressOffset'),)
+    __slots__ = ('_parent', '_gdb', '_model', '_i', '_name',
+                 '_addr', '_objs')
+    _kind = 'registers'
 
-    def __init__(self, svd, parent):
-        super().__init__(svd, parent)
+    def __init__(self, parent, i, r=None):
+        super().__init__(parent, i, r)
+
+        t = self._model.registers
+        self._addr = parent._addr + t.offset[i]
+        if r is not None:
+            self._addr += r*t.dim[i][1]
+        self._objs = None
 
-        self._fields = []
-        self._fieldmap = {}
-        fsvd = svd.find('fields')
+    def _layout(self):
+        return self._model.layout('registers', self._i)
 
-        if fsvd is not None:
-            for f in fsvd.findall('field'):
-                # Deal with derived fields when we actually find an
-                # SVD with derived field.
+    @property
+    def _fields(self):
+        return self._children('fields')
 
-                xx = f.attrib.get('derivedFrom',None)
-                assert xx is None
-                for ff in make_field(f, self):
-                    self._fields.append(ff)
-                    setattr(self, ff._name, ff)
-                    self._fieldmap[ff._name] = ff
+    @property
+    def _fieldmap(self):
+        return self._childmap('fields')
 
     @property
     def _address(self):
-        return Int32(self._address_offset + self._parent._address)
+        return Int32(self._addr)
+
+    @property
+    def _address_offset(self):
+        return self._addr - self._parent._addr
+
+    @property
+    def _size(self):
+        return self._model.registers.size[self._i]
+
+    @property
+    def _access(self):
+        return model.ACCESS[self._model.registers.access[self._i]]
+
+    @property
+    def _reset_value(self):
+        return Int32(self._model.registers.reset[self._i])
+
+    def _raw(self):
+        "Value as a plain int"
+        return self._gdb.read32(self._addr)
 
     def _get(self):
-        return Int32(self._gdb.read32(self._address))
+        return Int32(self._gdb.read32(self._addr))
 
     def _set(self, value):
-        return self._gdb.write32(self._address, int(value))
+        return self._gdb.write32(self._addr, int(value))
 
     def _set_bit(self, bit):
-        return self._gdb.set_bit(self._address, bit)
+        return self._gdb.set_bit(self._addr, bit)
 
     def _clear_bit(self, bit):
-        return self._gdb.clear_bit(self._address, bit)
+        return self._gdb.clear_bit(self._addr, bit)
 
     def _is_bit_set(self, bit):
-        return self._gdb.is_bit_set(self._address, bit)
+        return self._gdb.is_bit_set(self._addr, bit)
 
     def _repr_no_get(self):
         return super().__repr__()
@@ -363,49 +521,54 @@ class Register(SvdObj, FieldHaver, MutableInteger):
     def _dump(self):
         print(self._dump_repr())
 
-class RegHaver():
+class RegHaver(LazyChildren):
+    __slots__ = ()
+
     def __setattr__(self, attname, value):
-        if hasattr(self, '_freezeattr'): # avoid recursion
-            self._registermap[attname]._set(value)
-        else:
+        if attname.startswith('_'):
             super().__setattr__(attname, value)
+        else:
+            self._child('registers', attname)._set(value)
 
-def regs_and_clusters(self, svd):
-
-    self._registers = getattr(self, '_registers', [])
-    self._registermap = getattr(self, '_registermap', {})
-    self._clusters = getattr(self, '_clusters', [])
-
-    if svd is None:
-        return
+    @property
+    def _registers(self):
+        return self._children('registers')
 
-    for r in svd.findall('register'):
-        for rr in make_register(r, self):
-            self._registers.append(rr)
-            self._registermap[rr._name] = rr
-            setattr(self, rr._name, rr)
-            rr._freezeattr = True
+    @property
+    def _registermap(self):
+        return self._childmap('registers')
 
-    for c in svd.findall('cluster'):
-        for cc in make_cluster(c, self):
-            self._clusters.append(cc)
-            setattr(self, cc._name, cc)
-            cc._freezeattr = True
+    @property
+    def _clusters(self):
+        return self._children('clusters')
 
 class Cluster(SvdObj, RegHaver):
-    _intfields = (('_address_offset','addressOffset'),)
+    __slots__ = ('_parent', '_gdb', '_model', '_i', '_name',
+                 '_addr', '_objs')
+    _kind = 'clusters'
 
-    def __init__(self, svd, parent):
-        super().__init__(svd, parent)
+    def __init__(self, parent, i, r=None):
+        super().__init__(parent, i, r)
+
+        t = self._model.clusters
+        self._addr = parent._addr + t.offset[i]
+        if r is not None:
+            self._addr += r*t.dim[i][1]
+        self._objs = None
 
-        regs_and_clusters(self, svd)
+    def _layout(self):
+        return self._model.layout('clusters', self._i)
 
     def __repr__(self):
         return repr(self._parent)+'.'+self._name
 
     @property
     def _address(self):
-        return Int32(self._address_offset + self._parent._address)
+        return Int32(self._addr)
+
+    @property
+    def _address_offset(self):
+        return self._addr - self._parent._addr
 
     @property
     def _child_regs(self):
@@ -415,99 +578,38 @@ class Cluster(SvdObj, RegHaver):
 
         return ret
 
-def fixup_eg_name(n):
-    "asdf[%s] -> asdf, False otherwise"
-    if n.endswith('[%s]'):
-        return n[:-4]
-    else:
-        return False
-
-def make_cls_or_array(svd, parent, cls):
-    """If there is no dim, just create a new object and return it.
-    If there is a plain dim like NAME[%s] then we need to return array-like.
-    If there is a dimIndex defined, then we need to return a list.
-
-    For convenience, we will *always* return a list, and the caller
-    won't need special-case code to apply it.
-
-    """
-
-    dim = svd.find('dim')
-    if dim is None:
-        return [cls(svd, parent)]
-    else:
-        dim = int0(dim.text)
-        dimIncrement = int0(svd.find('dimIncrement').text)
-
-        di = svd.find('dimIndex')
-        if di is not None:
-            t = di.text.strip()
-            if "," in t:
-                dimIndex = t.split(',')
-            elif "-" in t:
-                first,last = t.split("-")
-                dimIndex = [str(x) for x in range(int(first),1+int(last))]
-        else:
-            dimIndex = [str(x) for x in range(dim)]
-
-        assert len(dimIndex) == dim
-
-        objs = []
-        for r in range(dim):
-            obj = cls(svd, parent)
-            if cls==Field:
-                obj._bit_offset += r*dimIncrement
-            else:
-                obj._address_offset += r*dimIncrement
-            obj._name %= dimIndex[r]
-            obj._freezeattr = True
-            objs.append(obj)
-
-        trimmed_name = fixup_eg_name(svd.find('name').text)
-        if trimmed_name:
-            eg = ElementGroup(objs)
-            eg._name = trimmed_name
-            return [eg]
-        else:
-            return objs
-
-def make_field(svd, parent):
-    return make_cls_or_array(svd, parent, Field)
-
-def make_cluster(svd, parent):
-    return make_cls_or_array(svd, parent, Cluster)
-
-def make_register(svd, parent):
-    return make_cls_or_array(svd, parent, Register)
-
 class Peripheral(RegHaver):
-    def __init__(self, svd, parent):
+    """Peripheral i of the model.  Its layout is shared with every
+    peripheral derivedFrom it that adds no registers, see
+    model.Model.layout()."""
+    __slots__ = ('_parent', '_gdb', '_model', '_i', '_name',
+                 '_addr', '_address', '_objs')
+
+    def __init__(self, parent, i):
         self._parent = parent
         self._gdb = parent._gdb
-        self._update(svd)
+        self._model = parent._model
+        self._i = i
 
-    def _update(self, svd):
-        self._svd = svd
-
-        self._name = svd.findtext('name').strip()
-        d = svd.find('description')
-        if d is not None:
-            self._description = d.text
-
-        self._address = Int32(int0(svd.find('baseAddress').text))
+        p = self._model.peripherals[i]
+        self._name = p['name']
+        self._addr = p['baseAddress']
+        self._address = Int32(self._addr)
+        self._objs = None
 
-        rsvd = svd.find('registers')
+    def _layout(self):
+        return self._model.layout('peripherals', self._i)
 
-        regs_and_clusters(self, rsvd)
-
-    def _copy(self):
-        c = self.__class__(self._svd, self._parent)
-        try:
-            del c._freezeattr
-        except AttributeError:
-            pass
-        assert c._registermap.keys() == self._registermap.keys()
-        return c
+    @property
+    def _description(self):
+        "Text as in the SVD, read back on use"
+        m = self._model
+        i = self._i
+        while 'description' not in m.peripherals[i]:
+            i = m.base(i) # derived peripherals keep the base's
+            if i is None:
+                raise AttributeError('_description')
+        return m.description(m.peripherals[i]['description'], lambda x:x)
 
     def __repr__(self):
         return repr(self._parent)+'.'+self._name
@@ -518,7 +620,7 @@ class Peripheral(RegHaver):
         for c in self._registers + self._clusters:
             regs.extend(c._child_regs)
 
-        regs.sort(key=lambda x:x._address)
+        regs.sort(key=lambda x:x._addr)
         return regs
 
     def _dump(self, file=None):
@@ -541,12 +643,12 @@ class DebugInterface():
 
     def read32(self, address):
         if self.verbose:
-            print("Read from",repr(address))
+            print("Read from 0x%08x"%address)
         return Int32(0)
 
     def write32(self, address, val):
         if self.verbose:
-            print("Write",val,"to",repr(address))
+            print("Write",val,"to 0x%08x"%address)
         pass
 
     def _set_bit_rmw(self, address, bit):
@@ -593,13 +695,21 @@ class GdbInterface(DebugInterface):
         self.gdb = gdb_
 
     def setup_make_stub(self, svd_device):
-        from . import make_stub
-        self.make_stub = make_stub.MakeStub(svd_device)
+        self._svd_device = svd_device
+        self._make_stub = None
+
+    @property
+    def make_stub(self):
+        "make_stub.MakeStub for the device, created on first use"
+        if self._make_stub is None:
+            from . import make_stub
+            self._make_stub = make_stub.MakeStub(self._svd_device)
+        return self._make_stub
 
     def read32(self, address):
         val = self.gdb.read32(address)
         if self.verbose:
-            print("Read from",repr(address),"= %08x"%val)
+            print("Read from 0x%08x = %08x"%(address, val))
         return val
 
     def read_mem(self, address, length):
@@ -609,7 +719,7 @@ class GdbInterface(DebugInterface):
 
     def write32(self, address, val):
         if self.verbose:
-            print("Write %08x"%val,"to",repr(address))
+            print("Write %08x to 0x%08x"%(val, address))
         return self.gdb.write32(address, val)
 
     def write_mem(self, addr, data):
@@ -622,6 +732,9 @@ class GdbInterface(DebugInterface):
         return self.gdb.target_name
 
 class Device():
+    # False to parse the SVD every time, see model.load()
+    _model_cache = True
+
     def __init__(self, xmlfilename, gdb=None):
         if gdb is None:
             gdb = DebugInterface()
@@ -629,36 +742,115 @@ class Device():
         self._gdb = gdb
 
         # print(xmlfilename.split('/')[-1])
-        tree = ET.parse(xmlfilename)
-        root = tree.getroot()
+        m = self._model = model.load(xmlfilename, self._model_cache)
 
-        self._name = root.find('name').text.strip()
+        self._name = m.name
 
-        c = root.find('cpu')
-        if c is not None:
-            self._cpu = CPU(root.find('cpu'), self)
+        if m.cpu is not None:
+            self._cpu = CPU(m.cpu, self)
         else:
             self._cpu = None
 
-        svd = root.find('peripherals')
-
-        self._peripherals = []
-        for psvd in svd.findall('peripheral'):
-            df = psvd.attrib.get('derivedFrom',None)
-            if df:
-                p = getattr(self, df)._copy()
-                p._update(psvd)
-            else:
-                p = Peripheral(psvd, self)
-            p._freezeattr = True
-            setattr(self, p._name, p)
-            self._peripherals.append(p)
+        # Peripherals are made on first use, see _peripheral()
+        self._pobjs = [None] * len(m.peripherals)
 
-        self._r=root
         self._gdb.setup_make_stub(self)
 
         self._pins = []
 
+    def _peripheral(self, i):
+        p = self._pobjs[i]
+        if p is None:
+            p = self._pobjs[i] = Peripheral(self, i)
+        return p
+
+    @property
+    def _peripherals(self):
+        return [self._peripheral(i) for i in range(len(self._pobjs))]
+
+    def __getattr__(self, attname):
+        # Only called for names not in __dict__, so once per peripheral
+        i = None
+        if '_pobjs' in self.__dict__:
+            i = self._peripheral_index().get(attname)
+        if i is None:
+            raise AttributeError("%r object has no attribute %r"%(
+                self.__class__.__name__, attname))
+        p = self._peripheral(i)
+        setattr(self, attname, p)
+        return p
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) |
+                      set(self._peripheral_index()))
+
+    def _peripheral_index(self):
+        "Peripheral name -> index for _peripheral()"
+        return self._model.peripheral_index()
+
+    def _address_index(self):
+        "index.AddressIndex of every register, made on first use"
+        ret = self.__dict__.get('_addr_index')
+        if ret is None:
+            from . import index
+            ret = self._addr_index = index.AddressIndex(index.all_registers(self))
+        return ret
+
+    def _registers_at(self, address, length=1):
+        """Registers overlapping length bytes at address, by address.
+        More than one for aliased registers."""
+        return self._address_index().find(address, address + length)
+
+    def _decode(self, address, data):
+        """[(register, value)] for the registers in data, bytes of
+        memory read from address, e.g. with read_mem()"""
+        return self._address_index().decode(address, data)
+
+    def _name_index(self):
+        "index.NameIndex of the whole device, made on first use"
+        ret = self.__dict__.get('_names')
+        if ret is None:
+            from . import index
+            ret = self._names = index.NameIndex(self)
+        return ret
+
+    def _find(self, pattern, kind='registers', how='glob', within=None):
+        """Paths of the objects of kind ('peripherals', 'registers',
+        'clusters', 'fields', 'enums' or 'descriptions') named like
+        pattern, see index.NameIndex.find().  within is an object to
+        search under instead of the whole device."""
+        if within is None:
+            names = self._name_index()
+        else:
+            from . import index
+            names = index.NameIndex(within)
+        return names.find(pattern, kind, how)
+
+    def _lookup(self, path):
+        "The object at path, like 'SAADC.CH[0].CONFIG' from _find()"
+        obj = self
+        for part in path.split('.'):
+            try:
+                obj = getattr(obj, part)
+            except AttributeError:
+                # NAME[%s] array element, by its name
+                name, bracket, _ = part.partition('[')
+                group = getattr(obj, name, None) if bracket else None
+                if not isinstance(group, ElementGroup):
+                    raise AttributeError(path)
+                obj = next((x for x in group if x._name == part), None)
+                if obj is None:
+                    raise AttributeError(path)
+        return obj
+
+    def _record(self, keep_reads=False):
+        """Context manager recording register accesses, see recorder.py.
+
+        with d._record() as rec: ...; then rec.replay() runs them again
+        as one stub call."""
+        from . import recorder
+        return recorder.Recording(self, keep_reads)
+
     def __repr__(self):
         return self._name
 
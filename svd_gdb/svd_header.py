@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+
+"""C peripheral header generated from a loaded svd_gdb.Device.
+
+Stubs can then be built without the vendor SDK.  Names follow the
+Python model, so d.GPIOC.CRH is GPIOC->CRH in C.  Every peripheral
+gets a struct type and a base pointer macro; every field gets _Pos
+and _Msk macros and every single-valued enumerated value a macro:
+
+  GPIOC->CRH |= GPIOC_CRH_MODE13_Msk;
+
+Peripherals with the same layout share the type and the field
+macros, which are named after the first of them (GPIOA_CRH_...).
+
+Registers that share an address end up in anonymous unions, which
+needs gnu99 or later (MakeStub uses gnu99).
+"""
+
+import re
+
+def c_name(name):
+    return re.sub(r'\W', '_', name)
+
+def c_type(reg):
+    "C type of a register, and its size in bytes"
+    n = {8: 1, 16: 2}.get(reg._size, 4)
+    return 'volatile uint%d_t'%(n * 8), n
+
+class _Writer():
+    def __init__(self):
+        self.reserved = 0
+
+    def pad(self, n, indent):
+        if n <= 0:
+            return []
+        self.reserved += 1
+        return ['%suint8_t RESERVED%d[%d];'%(indent, self.reserved, n)]
+
+    def members(self, items, indent):
+        """items are (offset, size, lines) sorted by offset.  Returns
+        lines of struct members, laid out at their offsets."""
+        groups = []
+        for item in items:
+            offset, size, lines = item
+            if groups and offset < groups[-1][1]:
+                groups[-1][1] = max(groups[-1][1], offset + size)
+                groups[-1][2].append(item)
+            else:
+                groups.append([offset, offset + size, [item]])
+
+        ret = []
+        pos = 0
+        for start, end, group in groups:
+            ret += self.pad(start - pos, indent)
+            if len(group) == 1:
+                ret += [indent + l for l in group[0][2]]
+            else:
+                ret.append(indent + 'union {')
+                for offset, size, lines in group:
+                    if offset == start:
+                        ret += [indent + '    ' + l for l in lines]
+                    else:
+                        ret.append(indent + '    struct {')
+                        ret += self.pad(offset - start, indent + '        ')
+                        ret += [indent + '        ' + l for l in lines]
+                        ret.append(indent + '    };')
+                ret.append(indent + '};')
+            pos = end
+        return ret, pos
+
+    def container(self, obj, base, indent):
+        "Members for the registers and clusters of obj"
+        items = []
+        for x in obj._registers + obj._clusters:
+            items += self.item(x, base, indent)
+        items.sort(key=lambda i: i[0])
+        return self.members(items, indent)
+
+    def item(self, x, base, indent):
+        "Returns [(offset, size, lines)] for a register, cluster or array"
+        if isinstance(x, tuple): # svd_gdb.ElementGroup
+            name = c_name(x._name)
+            first = x[0]
+            offset = first._address - base
+            stride = (x[1]._address - first._address) if len(x) > 1 else 0
+            if hasattr(first, '_fields'):
+                t, n = c_type(first)
+                if stride in (0, n):
+                    return [(offset, n * len(x),
+                             ['%s %s[%d];'%(t, name, len(x))])]
+                return [(r._address - base, n, ['%s %s_%d;'%(t, name, i)])
+                        for i, r in enumerate(x)]
+            body, size = self.container(first, first._address, '    ')
+            if stride:
+                body += self.pad(stride - size, '    ')
+                size = stride
+            return [(offset, size * len(x),
+                     ['struct {'] + body + ['} %s[%d];'%(name, len(x))])]
+
+        offset = x._address - base
+        if hasattr(x, '_fields'):
+            t, n = c_type(x)
+            return [(offset, n, ['%s %s;'%(t, c_name(x._name))])]
+        body, size = self.container(x, x._address, '    ')
+        return [(offset, size,
+                 ['struct {'] + body + ['} %s;'%c_name(x._name)])]
+
+def _field_macros(prefix, obj, out, seen):
+    for x in obj._registers + obj._clusters:
+        if isinstance(x, tuple):
+            name, x = x._name, x[0]
+        else:
+            name = x._name
+        name = prefix + '_' + c_name(re.sub(r'\[.*\]$', '', name))
+        if not hasattr(x, '_fields'):
+            _field_macros(name, x, out, seen)
+            continue
+
+        fields = []
+        for f in x._fields:
+            fields += f if isinstance(f, tuple) else [f]
+        for f in fields:
+            fname = name + '_' + c_name(re.sub(r'\[(\w+)\]', r'\1', f._name))
+            if fname in seen:
+                continue
+            seen.add(fname)
+            mask = ((1 << f._bit_width) - 1) << f._bit_offset
+            out.append('#define %s_Pos %d'%(fname, f._bit_offset))
+            out.append('#define %s_Msk 0x%08xUL'%(fname, mask))
+            for e in f._enum:
+                ename = fname + '_' + c_name(e._name)
+                value = e._single()
+                if value is not None and ename not in seen:
+                    seen.add(ename)
+                    out.append('#define %s %dUL'%(ename, value))
+
+def device_header(device):
+    "Returns C header text for device"
+    guard = c_name(device._name).upper() + '_SVD_H'
+    out = ['/* Generated by svd_gdb from the SVD for %s */'%device._name,
+           '#ifndef ' + guard,
+           '#define ' + guard,
+           '',
+           '#include <stdint.h>',
+           '']
+
+    types = {} # struct body -> type name
+    bases = []
+    macros = []
+    seen = set()
+    for p in device._peripherals:
+        w = _Writer()
+        body, size = w.container(p, p._address, '    ')
+        key = '\n'.join(body)
+        name = c_name(p._name)
+        if key not in types:
+            types[key] = name
+            out.append('typedef struct {')
+            out += body
+            out.append('} %s_Type;'%name)
+            out.append('')
+            _field_macros(name, p, macros, seen)
+        bases.append('#define %s ((%s_Type *)0x%08xUL)'%(
+            name, types[key], p._address))
+
+    out += bases + [''] + macros + ['', '#endif']
+    return '\n'.join(out) + '\n'
@@ -0,0 +1,447 @@
+#!/usr/bin/python3
+
+"""Python accessor module generated from a loaded svd_gdb.Device.
+
+ python3 -m svd_gdb.svd_python SVD_FILE OUT.py
+
+For devices used often, the SVD can be turned into a module ahead of
+time, so that no XML (nor model cache) is read at runtime:
+
+  from nrf52_svd import Device
+  d = Device(svd_gdb.GdbInterface(target))
+  d.POWER.RESETREAS._dump()
+
+The generated Device and peripherals are subclasses of the ones in
+svd_gdb.py, with the same attributes, but take their SVD data from
+constants instead of a model.Model.  Each peripheral is a class with
+__slots__ = (), its base address and its layout.  Clusters, registers
+and fields are constant tuples, rows like the model's:
+
+  cluster:  (name, dim, offset, description, entries)
+  register: (name, dim, offset, size, access, reset value,
+             description, entries, field rows)
+  field:    (name, dim, bit offset, bit width, access, description,
+             enumerated values)
+
+entries are the (kind, row, dim index, name) of the children, as in
+model.Model.layout(), with row the child's tuple, or for fields its
+position in the field rows.  The views are the svd_gdb.py classes
+with _i holding the row itself rather than a row number.  Registers
+and fields are rows rather than classes since a big SVD has
+thousands, and a module that made a class of each would take longer
+to import than the model cache takes to load.
+
+The module is written with write_module(), which also byte-compiles
+it.  verify() checks a generated Device against the dynamic one, and
+the command line above runs it on the new module.
+"""
+
+import re
+import sys
+import time
+
+from . import model
+from .svd_gdb import (Device, Peripheral, Cluster, Register, Field,
+                      DebugInterface, CPU, Int32, make_elements,
+                      enumerated_values, strip)
+
+def _cached(obj, make):
+    """make() for obj's row, kept by id() of the row in a dict on the
+    generated peripheral class, which holds the row alive and goes
+    with its module"""
+    p = obj._parent
+    while not isinstance(p, StaticPeripheral):
+        p = p._parent
+    cls = type(p)
+    cache = cls.__dict__.get('_cache')
+    if cache is None:
+        cache = cls._cache = {}
+    ret = cache.get(id(obj._i))
+    if ret is None:
+        ret = cache[id(obj._i)] = make()
+    return ret
+
+class StaticRegHaver():
+    __slots__ = ()
+
+    def _make(self, entry):
+        kind, row, r, name = entry
+        cls = StaticRegister if kind == 'registers' else StaticCluster
+        return make_elements(lambda r: cls(self, row, r), row[1], r, name)
+
+class StaticField(Field):
+    __slots__ = ()
+
+    def __init__(self, parent, row, r=None):
+        self._parent = parent
+        self._gdb = parent._gdb
+        self._i = row
+
+        name, d, bit_offset, self._bit_width = row[:4]
+        if r is not None:
+            name %= d[2][r]
+            bit_offset += r*d[1]
+        self._name = name
+        self._bit_offset = bit_offset
+
+    @property
+    def _description(self):
+        return self._i[5]
+
+    @property
+    def _access(self):
+        return self._i[4]
+
+    @property
+    def _enum(self):
+        "Enumeration, made once per field row and peripheral class"
+        return _cached(self, lambda: enumerated_values(self._i[6] or (),
+                                                       self._bit_width))
+
+    def _enum_names(self):
+        return [e[1] for e in self._i[6] or ()]
+
+def _init(obj, parent, row, r):
+    "Register or cluster obj for dim element r of row, or the row"
+    obj._parent = parent
+    obj._gdb = parent._gdb
+    obj._i = row
+
+    name, d, offset = row[:3]
+    if r is not None:
+        name %= d[2][r]
+        offset += r*d[1]
+    obj._name = name
+    obj._addr = parent._addr + offset
+    obj._objs = None
+
+class StaticRegister(Register):
+    __slots__ = ()
+
+    def __init__(self, parent, row, r=None):
+        _init(self, parent, row, r)
+
+    def _layout(self):
+        return _cached(self, lambda: model.make_layout(self._i[7]))
+
+    def _make(self, entry):
+        kind, j, r, name = entry
+        row = self._i[8][j]
+        return make_elements(lambda r: StaticField(self, row, r),
+                             row[1], r, name)
+
+    @property
+    def _size(self):
+        return self._i[3]
+
+    @property
+    def _access(self):
+        return self._i[4]
+
+    @property
+    def _reset_value(self):
+        return Int32(self._i[5])
+
+    @property
+    def _description(self):
+        return self._i[6]
+
+class StaticCluster(StaticRegHaver, Cluster):
+    __slots__ = ()
+
+    def __init__(self, parent, row, r=None):
+        _init(self, parent, row, r)
+
+    def _layout(self):
+        return _cached(self, lambda: model.make_layout(self._i[4]))
+
+    @property
+    def _description(self):
+        return self._i[3]
+
+class StaticPeripheral(StaticRegHaver, Peripheral):
+    "Generated classes set _row_name, _base_address, _lay and maybe _description"
+    __slots__ = ()
+
+    def __init__(self, parent):
+        self._parent = parent
+        self._gdb = parent._gdb
+        self._name = self._row_name
+        self._addr = self._base_address
+        self._address = Int32(self._addr)
+        self._objs = None
+
+    def _layout(self):
+        return self._lay
+
+    @property
+    def _description(self):
+        raise AttributeError('_description')
+
+class StaticDevice(Device):
+    "The generated module's Device, constructed from a DebugInterface"
+    _device_name = None
+    _cpu_svd = None
+    _peripheral_classes = ()
+    _pindex = {}
+
+    def __init__(self, gdb=None):
+        if gdb is None:
+            gdb = DebugInterface()
+
+        self._gdb = gdb
+        self._name = self._device_name
+
+        if self._cpu_svd is not None:
+            self._cpu = CPU(self._cpu_svd, self)
+        else:
+            self._cpu = None
+
+        self._pobjs = [None] * len(self._peripheral_classes)
+
+        self._gdb.setup_make_stub(self)
+
+        self._pins = []
+
+    def _peripheral(self, i):
+        p = self._pobjs[i]
+        if p is None:
+            p = self._pobjs[i] = self._peripheral_classes[i](self)
+        return p
+
+    def _peripheral_index(self):
+        return self._pindex
+
+# Names the generated module imports
+IMPORTED = ('StaticDevice', 'StaticPeripheral')
+
+class _Writer():
+    def __init__(self, m):
+        self.m = m
+        self.out = []
+        self.names = set(IMPORTED) | {'Device'}
+        self.rows = {} # (kind, row) -> name in the module
+
+        # Descriptions are read back from the SVD in one go per table
+        self.desc = {}
+        for kind in ('registers', 'clusters', 'fields'):
+            t = m.table(kind)
+            self.desc[kind] = m.descriptions(list(zip(t.desc_start,
+                                                      t.desc_end)))
+        enums = [e or () for e in m.fields.enum]
+        descriptions = iter(m.descriptions([v[2] for e in enums for v in e],
+                                           strip))
+        self.enums = [tuple((value, name, next(descriptions))
+                            for value, name, span in e) or None
+                      for e in enums]
+
+    def unique(self, prefix, name):
+        "Python name for name, within prefix"
+        name = re.sub(r'\W', '', name.replace('%s', ''))
+        if prefix:
+            name = prefix + '_' + name
+        if not name.isidentifier():
+            name = '_' + name
+        ret = name
+        n = 1
+        while ret in self.names:
+            n += 1
+            ret = '%s_%d'%(name, n)
+        self.names.add(ret)
+        return ret
+
+    def dim(self, d):
+        return None if d is None else (d[0], d[1], tuple(d[2]))
+
+    def entries(self, entries, prefix):
+        "Source of a tuple of register and cluster entries"
+        lines = ['(']
+        for kind, i, r, name in entries:
+            row = self.row(kind, i, prefix)
+            lines.append('    (%r, %s, %r, %r),'%(kind, row, r, name))
+        lines.append(')')
+        return '\n'.join(lines)
+
+    def row(self, kind, i, prefix):
+        "Name of register or cluster row i, written on first use"
+        ret = self.rows.get((kind, i))
+        if ret is None:
+            if kind == 'registers':
+                ret = self.register(i, prefix)
+            else:
+                ret = self.cluster(i, prefix)
+            self.rows[(kind, i)] = ret
+        return ret
+
+    def register(self, i, prefix):
+        m = self.m
+        t = m.registers
+        name = self.unique(prefix, t.name[i])
+
+        field0 = t.field0[i]
+        f = m.fields
+        entries = tuple((kind, j - field0, r, fname)
+                        for kind, j, r, fname in m.layout('registers', i)[0])
+        rows = [repr((f.name[j], self.dim(f.dim[j]),
+                      f.bit_offset[j], f.bit_width[j],
+                      model.ACCESS[f.access[j]],
+                      self.desc['fields'][j],
+                      self.enums[j]))
+                for j in range(field0, field0 + t.nfields[i])]
+
+        self.out.append('%s = (%r, %r, 0x%x, %r, %r, 0x%08x,'%(
+            name, t.name[i], self.dim(t.dim[i]), t.offset[i], t.size[i],
+            model.ACCESS[t.access[i]], t.reset[i]))
+        self.out.append('    %r,'%(self.desc['registers'][i],))
+        self.out.append('    %r,'%(entries,))
+        self.out.append('    (' + ''.join('\n        %s,'%r for r in rows) + '))')
+        return name
+
+    def cluster(self, i, prefix):
+        m = self.m
+        t = m.clusters
+        name = self.unique(prefix, t.name[i])
+        entries = self.entries(m.layout('clusters', i)[0], name)
+        self.out.append('%s = (%r, %r, 0x%x, %r, %s)'%(
+            name, t.name[i], self.dim(t.dim[i]), t.offset[i],
+            self.desc['clusters'][i], entries))
+        return name
+
+    def peripheral(self, device, i):
+        "Class name for peripheral i, written after its base"
+        ret = self.rows.get(('peripherals', i))
+        if ret is not None:
+            return ret
+
+        m = self.m
+        p = m.peripherals[i]
+        base = m.base(i)
+        if base is not None:
+            base_name = self.peripheral(device, base)
+
+        name = self.unique('', p['name'])
+        layout = m.layout('peripherals', i)
+        if base is not None and layout is m.layout('peripherals', base):
+            lay = base_name + '._lay'
+        else:
+            lay = '(%s,\n    %r)'%(self.entries(layout[0], name), layout[1])
+
+        self.out.append('class %s(StaticPeripheral):'%name)
+        self.out.append('    __slots__ = ()')
+        self.out.append('    _row_name = %r'%p['name'])
+        self.out.append('    _base_address = 0x%08x'%p['baseAddress'])
+        try:
+            self.out.append('    _description = %r'%(
+                device._peripheral(i)._description,))
+        except AttributeError:
+            pass
+        self.out.append('    _lay = ' + lay.replace('\n', '\n    '))
+        self.out.append('')
+        self.rows[('peripherals', i)] = name
+        return name
+
+def device_module(device):
+    "Returns Python source of the accessor module for device"
+    w = _Writer(device._model)
+    w.out += ['# Generated by svd_gdb.svd_python from the SVD for %s'%device._name,
+              '',
+              'from svd_gdb.svd_python import %s'%', '.join(IMPORTED),
+              '']
+
+    classes = [w.peripheral(device, i)
+               for i in range(len(device._model.peripherals))]
+
+    w.out += ['class Device(StaticDevice):',
+              '    _device_name = %r'%device._name,
+              '    _cpu_svd = %r'%(device._cpu._svd if device._cpu else None,),
+              '    _peripheral_classes = (']
+    w.out += ['        %s,'%c for c in classes]
+    w.out += ['    )',
+              '    _pindex = %r'%device._model.peripheral_index()]
+    return '\n'.join(w.out) + '\n'
+
+def write_module(device, filename):
+    "Writes device_module() to filename, and byte-compiles it"
+    import py_compile
+
+    with open(filename, 'w') as f:
+        f.write(device_module(device))
+    py_compile.compile(filename, doraise=True)
+
+MISSING = object()
+
+ATTRIBUTES = ('_name', '_address', '_address_offset', '_size', '_access',
+              '_reset_value', '_description', '_bit_offset', '_bit_width')
+
+def _compare(a, b, path, out):
+    if isinstance(a, tuple): # svd_gdb.ElementGroup
+        if type(a) != type(b) or len(a) != len(b) or a._name != b._name:
+            out.append('%s: %r != %r'%(path, a, b))
+            return
+        for r, (x, y) in enumerate(zip(a, b)):
+            _compare(x, y, '%s[%d]'%(path, r), out)
+        return
+
+    for att in ATTRIBUTES:
+        x = getattr(a, att, MISSING)
+        y = getattr(b, att, MISSING)
+        if x != y or type(x) != type(y):
+            out.append('%s.%s: %r != %r'%(path, att, x, y))
+    if repr(a) != repr(b):
+        out.append('%s: repr %r != %r'%(path, a, b))
+
+    if hasattr(a, '_enum'):
+        x = [(e._name, e._value, e._dont_care, e._default, e._description)
+             for e in a._enum]
+        y = [(e._name, e._value, e._dont_care, e._default, e._description)
+             for e in b._enum]
+        if x != y:
+            out.append('%s._enum: %r != %r'%(path, x, y))
+        return
+
+    names = list(a._layout()[1])
+    if names != list(b._layout()[1]):
+        out.append('%s: children %r != %r'%(path, names, list(b._layout()[1])))
+        return
+    for name in names:
+        _compare(getattr(a, name), getattr(b, name), path + '.' + name, out)
+
+def verify(dynamic, static):
+    """Differences between the Device from the SVD and one from the
+    generated module, as a list of strings; empty when they agree"""
+    out = []
+    x = [n for n in dir(dynamic) if not n.startswith('_')]
+    y = [n for n in dir(static) if not n.startswith('_')]
+    if x != y:
+        out.append('dir(): %r != %r'%(x, y))
+    if repr(dynamic._cpu) != repr(static._cpu):
+        out.append('_cpu: %r != %r'%(dynamic._cpu, static._cpu))
+    for a, b in zip(dynamic._peripherals, static._peripherals):
+        _compare(a, b, repr(a), out)
+    return out
+
+def main(svd_filename, filename):
+    import os
+    import importlib.util
+
+    dynamic = Device(svd_filename)
+    write_module(dynamic, filename)
+
+    t0 = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(
+        os.path.splitext(os.path.basename(filename))[0], filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    static = module.Device()
+    print('Wrote %s, imports in %.3fs'%(filename, time.perf_counter() - t0))
+
+    diffs = verify(dynamic, static)
+    for d in diffs:
+        print(d)
+    if diffs:
+        sys.exit('%d differences from %s'%(len(diffs), svd_filename))
+
+if __name__=="__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,8 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    "Model and stub caches in the test's own directory, not ~/.cache"
+    path = tmp_path / 'svd_gdb_cache'
+    monkeypatch.setenv('SVD_GDB_CACHE', str(path))
+    return path
@@ -0,0 +1,110 @@
+"""A pretend gdb server, standing in for the socket of a gdb.Target"""
+
+import struct
+
+from svd_gdb.gdb import hexify, unhexify
+
+def unescape(data):
+    ret = bytearray()
+    it = iter(data)
+    for c in it:
+        ret.append(next(it) ^ 0x20 if c == ord('}') else c)
+    return bytes(ret)
+
+class FakeStub():
+    """Answers the packets Target sends with memory, 21 core
+    registers and some canned replies.  Every packet received is kept
+    in self.packets.  Code run with 'c' stops at once, returning 0,
+    after calling on_continue if that is set."""
+
+    def __init__(self, ram_size=0x1000):
+        self.regs = [0x1000 + i for i in range(21)]
+        self.mem = bytearray(ram_size) # at 0x20000000
+        self.packets = []
+        self.crc_reply = None # qCRC answer, default unsupported
+        self.connected = True
+        self.on_continue = None
+        self.timeout = None
+        self.out = bytearray()
+
+    # socket
+    def setsockopt(self, *args):
+        pass
+
+    def gettimeout(self):
+        return self.timeout
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def flushInput(self):
+        pass
+
+    def recv(self, n):
+        if not self.connected:
+            raise ConnectionResetError('fake stub gone')
+        ret = bytes(self.out[:n])
+        del self.out[:n]
+        return ret
+
+    def send(self, data):
+        if data in (b'+', b'-'):
+            return
+        packet = unescape(data[1:data.rindex(b'#')])
+        self.packets.append(packet)
+        self.out += b'+'
+        reply = self.reply(packet)
+        if reply is not None:
+            self.out += b'$%s#%02x'%(reply, sum(reply) & 0xff)
+
+    def sent(self, prefix):
+        "Packets received that start with prefix"
+        return [p for p in self.packets if p.startswith(prefix)]
+
+    # gdb server
+    def reply(self, p):
+        if p == b'qSupported':
+            return b'PacketSize=400;qXfer:memory-map:read+'
+        if p == b'g':
+            return hexify(struct.pack('<21I', *self.regs))
+        if p.startswith(b'G'):
+            self.regs = list(struct.unpack('<21I', unhexify(p[1:])))
+            return b'OK'
+        if p.startswith(b'p'):
+            return hexify(struct.pack('<I', self.regs[int(p[1:], 16)]))
+        if p.startswith(b'P'):
+            n, value = p[1:].split(b'=')
+            self.regs[int(n, 16)], = struct.unpack('<I', unhexify(value))
+            return b'OK'
+        if p.startswith(b'm'):
+            addr, length = (int(x, 16) for x in p[1:].split(b','))
+            if 0x20000000 <= addr < 0x20000000 + len(self.mem):
+                return hexify(bytes(self.mem[addr - 0x20000000:][:length]))
+            return hexify(bytes(length))
+        if p.startswith(b'X'):
+            header, data = p[1:].split(b':', 1)
+            addr = int(header.split(b',')[0], 16)
+            if 0x20000000 <= addr < 0x20000000 + len(self.mem):
+                start = addr - 0x20000000
+                self.mem[start:start + len(data)] = data
+            return b'OK'
+        if p.startswith(b'qRcmd,'):
+            if unhexify(p[6:]).startswith(b'reset'):
+                self.regs = [0] * 21
+            return b'OK'
+        if p.startswith(b'qCRC:'):
+            return self.crc_reply if self.crc_reply is not None else b''
+        if p == b'c':
+            if self.on_continue:
+                self.on_continue()
+            self.regs[0] = 0
+            return b'S05'
+        return b''
+
+class FakeMakeStub():
+    "Stands in for make_stub.MakeStub, without a compiler"
+    function_addr = 0x20000000
+    heap_addr = 0x20000400
+
+    def __call__(self, c_code, **kwargs):
+        return b'\x00\xbe' * 32
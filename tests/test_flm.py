@@ -0,0 +1,63 @@
+import os
+import sys
+import random
+sys.path.insert(0, os.path.dirname(__file__))
+
+from svd_gdb import gdb, flm
+from fake_stub import FakeStub, FakeMakeStub
+
+class FakeAlgorithm():
+    "Stands in for a .FLM file"
+    image = bytes(range(64))
+    static_base = 48
+    functions = {'Init': 1, 'UnInit': 5, 'EraseSector': 9, 'ProgramPage': 13}
+    address = 0
+    size = 0x10000
+    page_size = 256
+    empty = 0xff
+    erase_timeout = 100
+
+    def __init__(self, filename):
+        pass
+
+    def sector_starts(self, address, length):
+        return range(address & ~0xfff, address + length, 0x1000)
+
+def test_mixed_pages_keep_algorithm(monkeypatch):
+    monkeypatch.setattr(flm, 'FlashAlgorithm', FakeAlgorithm)
+    stub = FakeStub(ram_size=0x2000)
+    t = gdb.Target(stub)
+    t.ram = [(0x20000000, 0x2000)]
+
+    calls = []
+    run = t.run_stub_timeout
+    def run_stub_timeout(timeout, code, address, *args, **kwargs):
+        calls.append(address)
+        return run(timeout, code, address, *args, **kwargs)
+    t.run_stub_timeout = run_stub_timeout
+
+    loader = flm.FlmLoader(t, 'fake.FLM', make_stub=FakeMakeStub())
+    batch = loader.pages_per_batch * 256
+
+    # compressible, then incompressible, then compressible again
+    rng = random.Random(1)
+    data = (b'\xff' * batch +
+            bytes(rng.randrange(256) for i in range(batch)) +
+            b'\xff' * batch)
+    mem = gdb.FlashMemory.Segment(0, 0x10000, 0x1000)
+    mem.prog(0, data)
+    loader.commit(mem)
+
+    assert FakeMakeStub.function_addr in calls # compressed batches
+    assert calls.count(loader.address) > 4 # Init, erase, batch, UnInit...
+
+    # The algorithm is loaded once for erasing and once for programming,
+    # and never again in between.
+    start = loader.image_address
+    end = start + len(FakeAlgorithm.image)
+    loads = 0
+    for p in stub.sent(b'X'):
+        addr, length = (int(x, 16) for x in p[1:].split(b':')[0].split(b','))
+        if addr < end and start < addr + length:
+            loads += 1
+    assert loads == 2
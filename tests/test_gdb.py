@@ -0,0 +1,113 @@
+import os
+import sys
+import struct
+import pytest
+sys.path.insert(0, os.path.dirname(__file__))
+
+from svd_gdb import gdb, stub_rpc
+from fake_stub import FakeStub, FakeMakeStub
+
+def connect():
+    stub = FakeStub()
+    return stub, gdb.Target(stub)
+
+def test_registers_cached_while_halted():
+    stub, t = connect()
+    assert t.read_regs()[3] == 0x1003
+    assert t.read_reg(3) == 0x1003
+    t.read_regs()
+    assert len(stub.sent(b'g')) == 1
+
+def test_monitor_forgets_registers():
+    stub, t = connect()
+    t.read_regs()
+    t.monitor('reset halt')
+    assert t.read_regs()[3] == 0
+    assert len(stub.sent(b'g')) == 2
+
+def test_scs_write_forgets_registers():
+    stub, t = connect()
+    t.read_regs()
+    t.write32(0xE000ED0C, 0x05FA0004) # AIRCR SYSRESETREQ
+    stub.regs[3] = 0
+    assert t.read_regs()[3] == 0
+    t.set_regs({3: 0x1003})
+    assert stub.regs[3] == 0x1003
+
+def test_ram_write_keeps_registers():
+    stub, t = connect()
+    t.read_regs()
+    t.write_mem(0x20000000, b'1234')
+    t.read_regs()
+    assert len(stub.sent(b'g')) == 1
+
+def test_holds_without_qcrc():
+    stub, t = connect()
+    assert not t.holds(0x20000000, b'1234')
+    stub.crc_reply = b'E01'
+    assert not t.holds(0x20000000, b'1234')
+    stub.crc_reply = b'C%x'%gdb.gdb_crc32(bytes(4))
+    assert t.holds(0x20000000, bytes(4))
+
+def test_holds_passes_on_faults():
+    stub, t = connect()
+    stub.crc_reply = b'garbage'
+    with pytest.raises(gdb.InvalidStubResponseException):
+        t.holds(0x20000000, b'1234')
+    stub.connected = False
+    with pytest.raises(ConnectionError):
+        t.holds(0x20000000, b'1234')
+
+def test_resume_forgets_disabled_irqs():
+    stub, t = connect()
+    t.ram = [(0x20000000, 0x1000)]
+    t.disable_irqs()
+    t.call_timeout(1, 0x20000000) # only the stub runs
+    assert t._irqs_disabled
+    t.resume()
+    assert not t._irqs_disabled
+
+def test_monitor_forgets_resident_rpc():
+    stub, t = connect()
+    t.ram = [(0x20000000, 0x1000)]
+    make_stub = FakeMakeStub()
+    entry = make_stub.function_addr
+    mailbox = make_stub.heap_addr
+    bkpt = entry + 0x10
+    starts = []
+
+    def dispatcher():
+        "Runs the batch if started at entry or resumed at its BKPT"
+        pc = stub.regs[15]
+        if pc == entry:
+            starts.append(pc)
+        elif pc != bkpt:
+            return # the firmware, not the stub
+        count, = struct.unpack_from('<I', stub.mem, mailbox - 0x20000000)
+        struct.pack_into('<I', stub.mem, mailbox + 4 - 0x20000000, count)
+        stub.regs[15] = bkpt
+    stub.on_continue = dispatcher
+
+    rpc = stub_rpc.StubRpc(t, make_stub, '', ['f'])
+    rpc.call('f')
+    rpc.flush()
+    rpc.call('f')
+    rpc.flush()
+    assert len(starts) == 1 # second batch ran at the BKPT
+
+    t.monitor('reset halt')
+    rpc.call('f')
+    rpc.flush()
+    assert len(starts) == 2 # uploaded and started again
+
+@pytest.mark.parametrize('crc_reply', [None, b'E01'])
+def test_diff_without_qcrc(crc_reply):
+    stub, t = connect()
+    stub.crc_reply = crc_reply
+    image = bytes(range(256)) * 8
+    stub.mem[:len(image)] = image
+    stub.mem[100:104] = b'xxxx'
+    stub.mem[1500] ^= 1
+    assert t.diff([(0x20000000, image)], leaf_size=64) == [
+        (0x20000064, 0x20000068), (0x200005dc, 0x200005dd)]
+    assert len(stub.sent(b'qCRC')) == 1 # then read back
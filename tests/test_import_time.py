@@ -0,0 +1,30 @@
+import os
+import sys
+import subprocess
+
+SCRIPT = '''
+import sys, time
+t0 = time.perf_counter()
+import svd_gdb.drivers.nrf5x
+print(time.perf_counter() - t0)
+print(' '.join(sorted(sys.modules)))
+'''
+
+# Only needed once an SVD is parsed, a stub built or a file fetched
+HEAVY = ('pyexpat', 'xml.dom.minidom', 'xml.etree.ElementTree',
+         'svd_gdb.make_stub', 'pooch', 'requests')
+
+def test_driver_import_is_cheap(tmp_path):
+    cache = tmp_path / 'cache'
+    env = dict(os.environ, SVD_GDB_CACHE=str(cache))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT],
+                                  cwd=root, env=env).decode().splitlines()
+
+    seconds = float(out[0])
+    modules = set(out[1].split())
+    assert 'svd_gdb.drivers.nrf5x' in modules
+    assert not modules & set(HEAVY)
+    # nothing parsed, so nothing cached
+    assert not cache.exists() or not any(cache.iterdir())
+    assert seconds < 1.0 # generous; about 0.05s when this was written
@@ -0,0 +1,23 @@
+import os
+
+import pytest
+
+from svd_gdb import svd_gdb
+
+SVD = os.path.join(os.path.dirname(__file__), 'mixed.svd')
+
+class Device(svd_gdb.Device):
+    _model_cache = False
+
+def test_find_and_lookup():
+    d = Device(SVD)
+    assert d._find('MATCH*') == ['UART.MATCH0', 'UART1.MATCH0',
+                                 'UART.MATCH1', 'UART1.MATCH1']
+    assert d._lookup('UART1.DMA.CNT')._address == 0x40002024
+    assert d._lookup('UART.FIFO[2]')._address == 0x4000100a
+
+@pytest.mark.parametrize('path', ['NOPE', 'UART.NOPE', 'UART.NOPE[1]',
+                                  'UART.FIFO[9]', 'UART.BAUD.MANT[1]'])
+def test_lookup_missing(path):
+    with pytest.raises(AttributeError):
+        Device(SVD)._lookup(path)
@@ -0,0 +1,31 @@
+import os
+
+from svd_gdb import make_stub
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+def test_indirect_header_changes_key(tmp_path):
+    inc = str(tmp_path / 'inc')
+    write(os.path.join(inc, 'device.h'), '#include "cmsis/core.h"\n')
+    core = os.path.join(inc, 'cmsis', 'core.h')
+    write(core, '#include <stdint.h>\n#define X 1\n')
+    code = '#include "device.h"\nvoid function(void) {}\n'
+
+    before = make_stub.resolve_includes(code, [inc])
+    assert [os.path.basename(f) for f, h in before] == ['device.h', 'core.h',
+                                                        'stdint.h']
+
+    # Same size and mtime, different contents
+    st = os.stat(core)
+    write(core, '#include <stdint.h>\n#define X 2\n')
+    os.utime(core, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert make_stub.resolve_includes(code, [inc]) != before
+
+def test_include_cycle(tmp_path):
+    inc = str(tmp_path)
+    write(os.path.join(inc, 'a.h'), '#include "b.h"\n')
+    write(os.path.join(inc, 'b.h'), '#include "a.h"\n')
+    assert len(make_stub.resolve_includes('#include "a.h"', [inc])) == 2
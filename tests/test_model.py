@@ -0,0 +1,71 @@
+import os
+
+from svd_gdb import svd_gdb, model, index, cache
+
+SVD = os.path.join(os.path.dirname(__file__), 'mixed.svd')
+
+class Device(svd_gdb.Device):
+    _model_cache = False
+
+def test_descriptions_share_one_open(monkeypatch):
+    opened = []
+    def counting_open(*args, **kwargs):
+        opened.append(args[0])
+        return open(*args, **kwargs)
+
+    d = Device(SVD)
+    monkeypatch.setattr(model, 'open', counting_open, raising=False)
+    texts = [r._description for r in index.all_registers(d)]
+    assert texts[:3] == ['Data byte', 'Status flags', 'Baud rate divisor']
+    assert d.UART._description == 'Serial port with byte and halfword registers'
+    assert len(opened) == 1
+
+WIDE = '''<?xml version="1.0" encoding="utf-8"?>
+<device schemaVersion="1.1">
+  <name>WIDE</name>
+  <peripherals>
+    <peripheral>
+      <name>TIMER</name>
+      <baseAddress>0x40000000</baseAddress>
+      <registers>
+        <register>
+          <name>COUNT</name>
+          <addressOffset>0x0</addressOffset>
+          <size>64</size>
+          <resetValue>0x1FFFFFFFF</resetValue>
+          <fields>
+            <field><name>HIGH</name><bitRange>[63:32]</bitRange></field>
+          </fields>
+        </register>
+      </registers>
+    </peripheral>
+  </peripherals>
+</device>
+'''
+
+def test_64_bit_register(tmp_path):
+    svd = tmp_path / 'wide.svd'
+    svd.write_text(WIDE)
+    model_cache = cache.ModelCache(str(tmp_path))
+    for i in range(2): # parsed, then from the model cache
+        class Cached(svd_gdb.Device):
+            _model_cache = model_cache
+        d = Cached(str(svd))
+        assert d.TIMER.COUNT._size == 64
+        assert d.TIMER.COUNT._reset_value == 0x1ffffffff
+        assert d.TIMER.COUNT.HIGH._bit_offset == 32
+
+def test_descriptions_file_closed(recwarn):
+    import gc
+    import warnings
+    warnings.simplefilter('always', ResourceWarning)
+    for i in range(3):
+        d = Device(SVD)
+        assert d.UART.CTRL._description == 'Control'
+    m = d._model
+    m.close()
+    assert m._file is None
+    assert d.UART.BAUD._description == 'Baud rate divisor' # opens again
+    del d, m
+    gc.collect()
+    assert not [w for w in recwarn if w.category is ResourceWarning]
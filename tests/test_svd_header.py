@@ -0,0 +1,34 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from svd_gdb import svd_gdb, svd_header
+
+SVD = os.path.join(os.path.dirname(__file__), 'mixed.svd')
+
+def test_register_widths():
+    header = svd_header.device_header(svd_gdb.Device(SVD))
+    for line in ('volatile uint8_t DATA;',
+                 'volatile uint8_t STATUS;',
+                 'volatile uint16_t BAUD;',
+                 'volatile uint32_t CTRL;',
+                 'volatile uint8_t FIFO[4];',
+                 'volatile uint16_t MATCH0;',
+                 'volatile uint16_t CNT;'):
+        assert '    ' + line in header
+
+OFFSETS = {'DATA': 0, 'STATUS': 1, 'BAUD': 2, 'CTRL': 4, 'FIFO': 8,
+           'MATCH0': 0xc, 'MATCH1': 0x10, 'DMA.CNT': 0x24}
+
+@pytest.mark.skipif(not shutil.which('gcc'), reason='no host gcc')
+def test_register_offsets(tmp_path):
+    header = svd_header.device_header(svd_gdb.Device(SVD))
+    (tmp_path / 'mixed.h').write_text(header)
+    c = ['#include <stddef.h>', '#include "mixed.h"']
+    c += ['_Static_assert(offsetof(UART_Type, %s) == %d, "%s");'%(m, o, m)
+          for m, o in OFFSETS.items()]
+    (tmp_path / 'check.c').write_text('\n'.join(c) + '\n')
+    subprocess.check_call(['gcc', '-std=gnu11', '-fsyntax-only',
+                           str(tmp_path / 'check.c')])
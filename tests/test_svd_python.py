@@ -0,0 +1,49 @@
+import os
+import gc
+import weakref
+import importlib.util
+
+from svd_gdb import svd_gdb, svd_python
+
+SVD = os.path.join(os.path.dirname(__file__), 'mixed.svd')
+
+def generate(tmp_path):
+    dynamic = svd_gdb.Device(SVD)
+    filename = str(tmp_path / 'mixed_svd.py')
+    svd_python.write_module(dynamic, filename)
+    spec = importlib.util.spec_from_file_location('mixed_svd', filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return dynamic, module.Device()
+
+def test_generated_module_matches_device(tmp_path):
+    dynamic, static = generate(tmp_path)
+    assert svd_python.verify(dynamic, static) == []
+
+    assert static.UART1.BAUD._address == 0x40002002
+    assert static.UART1.BAUD._reset_value == 0x683
+    assert static.UART.DMA.CNT._size == 16
+    assert [f._name for f in static.UART.BAUD._fields] == ['FRAC', 'MANT']
+    assert [e._name for e in static.UART.CTRL.MODE._enum] == [
+        'Off', 'Tx', 'Rx', 'Both']
+
+def test_verify_finds_differences(tmp_path):
+    dynamic, static = generate(tmp_path)
+    uart = static._peripheral_classes[static._peripheral_index()['UART']]
+    uart._base_address += 4
+    diffs = svd_python.verify(dynamic, static)
+    assert 'MIXED.UART._address: 0x40001000 != 0x40001004' in diffs
+
+def test_module_not_kept_alive(tmp_path):
+    dynamic, static = generate(tmp_path)
+    assert svd_python.verify(dynamic, static) == [] # fills the caches
+    uart = weakref.ref(type(static.UART))
+    enum = weakref.ref(static.UART.CTRL.MODE._enum)
+    del static
+    gc.collect()
+    assert uart() is None
+    assert enum() is None
+
+def test_cache_is_private(cache_dir, tmp_path):
+    generate(tmp_path)
+    assert os.listdir(str(cache_dir / 'models')) # the model was cached here